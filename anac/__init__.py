@@ -1,21 +1,25 @@
 import logging
 from datetime import datetime
+from multiprocessing import current_process
 import os
 
 now = datetime.now().strftime('%Y%m%dT%H%M%S')
-os.makedirs('logs', exist_ok=True)
 path = f'logs/ANAC_{now}.log'
 
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s : %(levelname)s : %(funcName)s : %(message)s',
-                    filename=path,
-                    filemode='w')
+# i processi avviati con --parsers importano di nuovo il package, già con
+# il proprio nome: solo il processo principale crea il file di log
+if current_process().name == 'MainProcess':
+    os.makedirs('logs', exist_ok=True)
 
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s : %(levelname)s : %(funcName)s : %(message)s',
+                        filename=path,
+                        filemode='w')
 
-console = logging.StreamHandler()
-console.setLevel(logging.INFO)
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
 
-formatter = logging.Formatter('%(asctime)s : %(levelname)s : %(funcName)s : %(message)s')
-console.setFormatter(formatter)
+    formatter = logging.Formatter('%(asctime)s : %(levelname)s : %(funcName)s : %(message)s')
+    console.setFormatter(formatter)
 
-logging.getLogger().addHandler(console)
+    logging.getLogger().addHandler(console)
@@ -0,0 +1,57 @@
+from anac import statements as stmts
+
+
+class BatchSizer:
+    '''
+    Dimensiona i pacchetti di righe da inserire. Il numero di righe si
+    adatta al tempo di inserimento misurato per avvicinarsi a "seconds"
+    per pacchetto, entro i limiti "floor" e "ceiling"; la dimensione
+    stimata in byte non supera mai "max_bytes".
+    '''
+    def __init__(self, max_bytes, size=stmts.BATCH_SIZE,
+                 floor=stmts.BATCH_MIN, ceiling=stmts.BATCH_MAX,
+                 seconds=stmts.BATCH_SECONDS):
+        self.max_bytes = max_bytes
+        self.floor = floor
+        self.ceiling = ceiling
+        self.seconds = seconds
+        self.size = min(max(size, floor), ceiling)
+
+    def update(self, rows, seconds):
+        '''
+        Aggiorna la dimensione in base all'ultimo inserimento.
+        '''
+        if not rows or seconds <= 0:
+            return
+
+        target = rows / seconds * self.seconds
+        size = (self.size + target) / 2
+
+        self.size = int(min(max(size, self.floor), self.ceiling))
+
+
+def row_size(row):
+    '''
+    Stima i byte occupati da una riga nello statement inviato al server.
+    '''
+    return 3 * len(row) + sum(map(len, map(str, row)))
+
+
+def get_batches(reader, sizer):
+    '''
+    Crea pacchetti di righe secondo la dimensione corrente di "sizer".
+    '''
+    while True:
+        batch, size = [], 0
+
+        for row in reader:
+            batch.append(row)
+            size += row_size(row)
+
+            if len(batch) >= sizer.size or size >= sizer.max_bytes:
+                break
+
+        if not batch:
+            return
+
+        yield tuple(batch)
@@ -0,0 +1,141 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from http.client import IncompleteRead
+from itertools import groupby
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from anac.metrics import metrics
+
+
+class Cache:
+    '''
+    Cache su disco dei file zip scaricati dal portale ANAC. Ogni file è
+    indicizzato con l'id della risorsa CKAN e la sua versione
+    ("last_modified" o ETag), così una risorsa aggiornata produce una
+    nuova voce mentre quelle invariate vengono lette dal disco.
+    '''
+    def __init__(self, path, offline=False):
+        self.path = path
+        self.offline = offline
+
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, res):
+        '''
+        Ritorna il nome della voce in cache associata alla risorsa.
+        '''
+        version = res.get('last_modified') or res.get('etag') or ''
+        digest = hashlib.sha1(f'{res["id"]}:{version}'.encode()).hexdigest()
+
+        return os.path.join(self.path, f'{res["id"]}-{digest[:16]}')
+
+    def get(self, res, table, pack):
+        '''
+        Ritorna il percorso del file zip della risorsa. Se il file è già
+        in cache esegue una richiesta condizionata e lo scarica solo se
+        il server lo ha modificato.
+        '''
+        key = self.key(res)
+        path, meta_path = f'{key}.zip', f'{key}.json'
+        name = f'{res["name"]}.json'
+
+        meta = {}
+        if os.path.exists(path) and os.path.exists(meta_path):
+            if self.offline:
+                return path
+
+            with open(meta_path) as file:
+                meta = json.load(file)
+
+        elif self.offline:
+            raise FileNotFoundError(f'"{name}" not in cache')
+
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('modified'):
+            headers['If-Modified-Since'] = meta['modified']
+
+        try:
+            start = time.perf_counter()
+
+            with urlopen(Request(res['url'], headers=headers)) as response:
+                logging.info('DOWNLOAD : "%s" ...', name)
+
+                with open(f'{path}.part', 'wb') as file:
+                    shutil.copyfileobj(response, file, 1 << 20)
+                    size = file.tell()
+
+                # le letture a blocchi non segnalano una connessione chiusa
+                # prima della fine del file
+                length = response.headers.get('Content-Length')
+                if length is not None and size < int(length):
+                    raise IncompleteRead(b'', int(length) - size)
+
+                meta = {'table': table,
+                        'package': pack,
+                        'resource': res,
+                        'etag': response.headers.get('ETag'),
+                        'modified': response.headers.get('Last-Modified')}
+
+        except HTTPError as err:
+            if err.code == 304:
+                logging.info('CACHE : "%s" not modified', name)
+                return path
+
+            raise
+
+        except BaseException:
+            if os.path.exists(f'{path}.part'):
+                os.remove(f'{path}.part')
+
+            raise
+
+        stats = metrics.record(table, name)
+        stats['download_bytes'] += size
+        stats['download_seconds'] += time.perf_counter() - start
+
+        os.replace(f'{path}.part', path)
+
+        with open(meta_path, 'w') as file:
+            json.dump(meta, file)
+
+        self.evict(res, key)
+
+        return path
+
+    def evict(self, res, keep):
+        '''
+        Elimina le versioni precedenti della risorsa.
+        '''
+        for old in glob.glob(os.path.join(self.path, f'{res["id"]}-*')):
+            if not old.startswith(f'{keep}.'):
+                os.remove(old)
+
+    def packages(self, tables):
+        '''
+        Ricostruisce dai metadati in cache l'elenco dei packages e delle
+        relative risorse, per eseguire il caricamento senza accedere al
+        portale.
+        '''
+        metas = []
+        for meta_path in glob.glob(os.path.join(self.path, '*.json')):
+            with open(meta_path) as file:
+                meta = json.load(file)
+
+            if meta['table'] in tables:
+                metas.append(meta)
+
+        def by_package(meta):
+            return meta['package'], meta['table']
+
+        metas.sort(key=lambda meta: (*by_package(meta), meta['resource']['name']))
+
+        for (pack, table), group in groupby(metas, key=by_package):
+            yield table, pack, [meta['resource'] for meta in group]
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ckanapi import RemoteCKAN
+
+from anac import statements as stmts
+
+
+def index(pckgs):
+    '''
+    Crea un indice dei packages col nome della tabella associata.
+    '''
+    tables = sorted(stmts.CREATE_TABLES, reverse=True, key=len)
+    prefixes = [(tab, (tab.replace('_', '-'), tab)) for tab in tables]
+
+    for pack in sorted(pckgs):
+        for tab, prefix in prefixes:
+            if pack.startswith(prefix):
+                yield tab, pack
+                break
+
+
+class Catalog:
+    '''
+    Catalogo dei packages del portale associati alle tabelle del db. Ad
+    ogni lettura dal portale il catalogo viene salvato in un file locale,
+    dal quale le esecuzioni successive possono pianificare il caricamento
+    senza interrogare il portale.
+    '''
+    def __init__(self, path, workers=stmts.CATALOG_WORKERS,
+                 url=stmts.URL_ANAC):
+        self.path = path
+        self.workers = workers
+        self.url = url
+
+    def read(self, tables=None):
+        '''
+        Ritorna le coppie (tabella, package) salvate nel file locale.
+        '''
+        try:
+            with open(self.path) as file:
+                snapshot = json.load(file)
+
+        except FileNotFoundError:
+            raise FileNotFoundError(
+                f'catalog "{self.path}" not found: run once without'
+                ' --snapshot to save it') from None
+
+        return [(entry['table'], entry['package']) for entry in snapshot
+                if tables is None or entry['table'] in tables]
+
+    def save(self, packages, tables=None):
+        '''
+        Salva i packages nel file locale, sostituendo quelli delle tabelle
+        indicate e conservando gli altri.
+        '''
+        kept = []
+        if tables is not None and os.path.exists(self.path):
+            kept = [(table, pack) for table, pack in self.read()
+                    if table not in tables]
+
+        snapshot = [{'table': table, 'package': pack}
+                    for table, pack in kept + packages]
+
+        with open(f'{self.path}.part', 'w') as file:
+            json.dump(snapshot, file)
+
+        os.replace(f'{self.path}.part', self.path)
+
+    def fetch(self, tables):
+        '''
+        Richiede al portale il dettaglio dei packages delle tabelle
+        indicate, con al massimo "workers" richieste in parallelo. Ogni
+        thread usa un proprio client, perché la sessione HTTP di un client
+        non può essere condivisa fra più thread.
+        '''
+        with RemoteCKAN(self.url) as ckan:
+            names = [(table, pack) for table, pack in
+                     index(ckan.action.package_list()) if table in tables]
+
+        local = threading.local()
+        clients = []
+
+        def show(item):
+            if (client := getattr(local, 'ckan', None)) is None:
+                client = local.ckan = RemoteCKAN(self.url)
+                clients.append(client)
+
+            return item[0], client.action.package_show(id=item[1])
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                packages = list(pool.map(show, names))
+
+        finally:
+            for client in clients:
+                client.close()
+
+        logging.info('%s packages from the portal', len(packages))
+
+        self.save(packages, tables)
+
+        return packages
+
+    def search(self, tables, rows=stmts.SEARCH_ROWS):
+        '''
+        Richiede al portale tutti i packages, risorse comprese, con una
+        chiamata a package_search ogni "rows" packages.
+        '''
+        results, start = {}, 0
+
+        with RemoteCKAN(self.url) as ckan:
+            while True:
+                page = ckan.action.package_search(rows=rows, start=start)
+                results.update((pack['name'], pack) for pack in page['results'])
+
+                start += rows
+                if start >= page['count']:
+                    break
+
+        packages = [(table, results[name]) for table, name in index(results)]
+
+        logging.info('%s packages from the portal', len(packages))
+
+        self.save(packages)
+
+        return [(table, pack) for table, pack in packages if table in tables]
@@ -0,0 +1,41 @@
+import re
+
+KEY = re.compile(r',\s*KEY\s+(\w+)\s*\(([^)]*)\)', re.IGNORECASE)
+
+
+def split_keys(ddl):
+    '''
+    Separa dal DDL di una tabella gli indici secondari. Ritorna il DDL
+    senza indici e le coppie (nome indice, colonne).
+    '''
+    return KEY.sub('', ddl), KEY.findall(ddl)
+
+
+TABLE = re.compile(r'(CREATE\s+TABLE\s+)(\w+)', re.IGNORECASE)
+
+
+def rename_table(ddl, name):
+    '''
+    Ritorna il DDL di una tabella con il nome sostituito da "name".
+    '''
+    return TABLE.sub(lambda match: match[1] + name, ddl, count=1)
+
+
+COLUMN = re.compile(r'^\s*(\w+)\s+([A-Za-z]+)\s*(?:\((\d+)\))?')
+
+NOT_COLUMNS = ('KEY', 'PRIMARY', 'UNIQUE', 'CREATE')
+
+
+def parse_columns(ddl):
+    '''
+    Ritorna le colonne definite nel DDL di una tabella come terne
+    (nome, tipo in minuscolo, dimensione o None).
+    '''
+    columns = []
+
+    for line in ddl.splitlines():
+        if (match := COLUMN.match(line)) and match[1].upper() not in NOT_COLUMNS:
+            size = match[3] and int(match[3])
+            columns.append((match[1], match[2].lower(), size))
+
+    return columns
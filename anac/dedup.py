@@ -0,0 +1,138 @@
+import hashlib
+from datetime import datetime, timedelta
+
+HASH_SIZE = 20
+
+INTEGER_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'bigint')
+STRING_TYPES = ('char', 'varchar', 'tinytext', 'text', 'mediumtext', 'longtext')
+
+
+class HashSet:
+    '''
+    Insieme compatto di impronte da 20 byte. Quelle già presenti nel
+    database sono conservate, ordinate, in un unico bytearray e cercate
+    per bisezione; quelle aggiunte durante il caricamento in un set.
+    '''
+    def __init__(self, hashes=()):
+        self.known = bytearray()
+        self.added = set()
+
+        for digest in hashes:
+            self.known += digest
+
+    def __len__(self):
+        return len(self.known) // HASH_SIZE + len(self.added)
+
+    def __contains__(self, digest):
+        if digest in self.added:
+            return True
+
+        known = self.known
+        lo, hi = 0, len(known) // HASH_SIZE
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            item = known[mid * HASH_SIZE:(mid + 1) * HASH_SIZE]
+
+            if item < digest:
+                lo = mid + 1
+            elif item > digest:
+                hi = mid
+            else:
+                return True
+
+        return False
+
+    def add(self, digest):
+        self.added.add(digest)
+
+
+def to_integer(value):
+    if isinstance(value, str):
+        value = value.strip()
+        return value if value.lstrip('-').isdigit() else None
+
+    if isinstance(value, float):
+        return None
+
+    return str(int(value))
+
+
+def to_double(value):
+    try:
+        value = float(value)
+    except ValueError:
+        return None
+
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+
+    if 1e-4 <= abs(value) < 1e15:
+        return repr(value)
+
+    return None
+
+
+def to_datetime(value):
+    try:
+        value = datetime.fromisoformat(str(value).replace('Z', ''))
+    except ValueError:
+        return None
+
+    if value.microsecond >= 500_000:
+        value += timedelta(seconds=1)
+
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def to_string(value):
+    if isinstance(value, bool):
+        return str(int(value))
+
+    return str(value)
+
+
+CONVERTERS = {'double': to_double, 'datetime': to_datetime}
+CONVERTERS.update(dict.fromkeys(INTEGER_TYPES, to_integer))
+CONVERTERS.update(dict.fromkeys(STRING_TYPES, to_string))
+
+
+class Fingerprint:
+    '''
+    Calcola lato client la stessa impronta della colonna "<table>_hash",
+    cioè UNHEX(SHA(CONCAT_WS(";", ...))) sui valori così come MySQL li
+    converte in testo. Se un valore non è convertibile con certezza
+    ritorna None e la riga viene comunque inviata al database, che
+    resta responsabile della deduplica.
+    '''
+    def __init__(self, columns, types):
+        self.converters = tuple(
+            CONVERTERS.get(types.get(col), lambda value: None)
+            for col in columns)
+
+    def __call__(self, row):
+        values = []
+
+        for value, convert in zip(row, self.converters):
+            if value is None:
+                continue
+
+            if (value := convert(value)) is None:
+                return None
+
+            values.append(value)
+
+        return hashlib.sha1(';'.join(values).encode()).digest()
+
+    def digest(self, row):
+        '''
+        Ritorna sempre un'impronta: se un valore non è convertibile con
+        certezza usa il testo dei valori. Serve ai database che non
+        calcolano la colonna "<table>_hash".
+        '''
+        if (digest := self(row)) is not None:
+            return digest
+
+        values = [to_string(value) for value in row if value is not None]
+
+        return hashlib.sha1(';'.join(values).encode()).digest()
@@ -1,51 +1,463 @@
+import copy
 import json
 import logging
+import os
+import re
 import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date
 from itertools import islice
+from multiprocessing import get_context
 
 from mysql.connector import errorcode, errors
+from mysql.connector.cursor import MySQLCursor
 from mysql.connector.pooling import MySQLConnectionPool
 from tqdm import tqdm
 
 from anac import statements as stmts
+from anac.batches import BatchSizer, get_batches
+from anac.ddl import rename_table, split_keys
+from anac.dedup import Fingerprint, HashSet
+from anac.metrics import metrics
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+# messaggio del server dopo un INSERT di più righe
+INSERT_INFO = re.compile(r'Records: (\d+)\s+Duplicates: (\d+)')
+
+_TSV_ESCAPES = str.maketrans({
+    '\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+
+def to_tsv(value):
+    '''
+    Converte un valore nel formato atteso da LOAD DATA: None diventa
+    "\\N" ed i caratteri speciali vengono preceduti da "\\".
+    '''
+    if value is None:
+        return '\\N'
+
+    if isinstance(value, bool):
+        return str(int(value))
+
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+
+    return str(value).translate(_TSV_ESCAPES)
+
+
+def decode_block(lines):
+    '''
+    Decodifica con una sola chiamata un blocco di righe json, unendole
+    in un array.
+    '''
+    lines = [line for line in lines if line.strip()]
+
+    if not lines:
+        return []
+
+    if isinstance(lines[0], bytes):
+        return loads(b'[' + b','.join(lines) + b']')
+
+    return loads('[' + ','.join(lines) + ']')
+
+
+def skip_rows(file, rows):
+    '''
+    Salta le prime "rows" righe json del file senza decodificarle.
+    '''
+    if not rows:
+        return file
+
+    return islice((line for line in file if line.strip()), rows, None)
+
+
+class RowMapper:
+    '''
+    Associa a ciascuna colonna di "refcols" la chiave corrispondente delle
+    righe json e ritorna i valori come tuple nell'ordine di "refcols". Le
+    associazioni sono calcolate una sola volta per ogni insieme di chiavi.
+    '''
+    def __init__(self, refcols):
+        self.refcols = tuple(refcols)
+        self.columns = sorted(refcols, key=len, reverse=True)
+        self.plans = {}
+
+    def plan(self, keys):
+        select = {}
+
+        for k in sorted(keys, key=len):
+            _k = k.replace('-', '_')
+
+            for col in self.columns:
+                starts = _k.lower().startswith(col.lower())
+
+                if starts and col not in select:
+                    select[col] = k
+                    break
+
+        return tuple(select.get(col) for col in self.refcols)
+
+    def __call__(self, row):
+        keys = tuple(row)
+
+        if (mapping := self.plans.get(keys)) is None:
+            mapping = self.plans[keys] = self.plan(keys)
+
+        return tuple(None if k is None else row[k] or None for k in mapping)
+
+
+# associazioni di ciascun processo del pool, riusate fra i blocchi
+_mappers = {}
+
+
+def parse_block(data, refcols):
+    '''
+    Decodifica nei processi del pool un blocco di righe json ricevuto come
+    unico oggetto bytes. Ritorna le righe come tuple ed i secondi impiegati.
+    '''
+    start = time.perf_counter()
+
+    if (fix := _mappers.get(refcols)) is None:
+        fix = _mappers[refcols] = RowMapper(refcols)
+
+    rows = [fix(row) for row in decode_block(data.split(b'\n'))]
+
+    return rows, time.perf_counter() - start
+
+
+def read_chunks(file, block, size=stmts.PARSE_BYTES):
+    '''
+    Legge il file in blocchi bytes di righe intere: di circa "size" byte
+    se il file lo consente, altrimenti di "block" righe.
+    '''
+    if not hasattr(file, 'read'):
+        while (lines := list(islice(file, block))):
+            data = lines[0][:0].join(lines)
+            yield data.encode() if isinstance(data, str) else data
+
+        return
+
+    rest = b''
+    while (chunk := file.read(size)):
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+
+        head, sep, tail = chunk.rpartition(b'\n')
+
+        if sep:
+            yield rest + head
+            rest = tail
+        else:
+            rest += chunk
+
+    if rest:
+        yield rest
+
+
+def parse_blocks(file, refcols, block, stats, pool, ahead):
+    '''
+    Invia al pool blocchi di righe del file e ritorna le righe decodificate
+    nell'ordine originale, così che le righe lette restino un prefisso del
+    file ed il salvataggio dei progressi resti valido.
+    '''
+    refcols = tuple(refcols)
+    chunks = read_chunks(file, block or stmts.DECODE_BLOCK)
+    pending = deque()
+
+    def submit():
+        start = time.perf_counter()
+        data = next(chunks, None)
+        stats['unzip_seconds'] += time.perf_counter() - start
+
+        if data is None:
+            return False
+
+        pending.append(pool.submit(parse_block, data, refcols))
+
+        return True
+
+    try:
+        while len(pending) < max(ahead, 1) and submit():
+            pass
+
+        while pending:
+            rows, seconds = pending.popleft().result()
+            submit()
+
+            stats['parse_seconds'] += seconds
+            stats['parse_rows'] += len(rows)
+
+            yield from rows
+
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class RowCounter:
+    '''
+    Conta le righe lette dal reader a partire da "count".
+    '''
+    def __init__(self, reader, count=0):
+        self.reader = iter(reader)
+        self.count = count
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self.reader)
+        self.count += 1
+
+        return row
+
+
+class InfoCursor(MySQLCursor):
+    '''
+    Cursore che conserva il messaggio informativo restituito dal server
+    insieme al numero di righe modificate.
+    '''
+    info = ''
+
+    def _handle_noresultset(self, res):
+        super()._handle_noresultset(res)
+
+        self.info = res.get('info_msg') or ''
 
 
 class DataBase:
-    def __init__(self, host, database, user, password):
+    '''
+    Database MySQL raggiunto tramite un pool di connessioni. Con
+    "local_infile" il server può chiedere al client solo i file della
+    directory temporanea, dove "insert_infile" scrive i file tsv.
+    '''
+    statements = stmts
+
+    # indici definiti nel DDL e colonna "<table>_hash" calcolata dal db
+    inline_keys = True
+    client_hash = False
+
+    def __init__(self, host, database, user, password, pool_size=5,
+                 compress=False, settings=stmts.SESSION_SETTINGS,
+                 local_infile=False):
         self.pool = MySQLConnectionPool(
             host=host,
             database=database,
             user=user,
             password=password,
             pool_name='anac',
+            pool_size=pool_size,
+            allow_local_infile=False,
+            allow_local_infile_in_path=(
+                tempfile.gettempdir() if local_infile else None),
             buffered=True,
-            autocommit=True)
+            autocommit=True,
+            compress=compress)
 
-    def execute(self, stmt, params=None, many=False):
-        with self.pool.get_connection() as cnx:
-            with cnx.cursor(dictionary=True) as cur:
-                if many:
-                    cur.executemany(stmt, params)
-                else:
-                    cur.execute(stmt, params)
+        self.settings = dict(settings)
+        self.refused = set()
+        self.local = threading.local()
+
+    @staticmethod
+    def run(cnx, stmt, params=None, many=False, cursor_class=None):
+        if cursor_class is None:
+            cur = cnx.cursor(dictionary=True)
+        else:
+            cur = cnx.cursor(cursor_class=cursor_class)
+
+        with cur:
+            if many:
+                cur.executemany(stmt, params)
+            else:
+                cur.execute(stmt, params)
 
         return cur
 
+    def execute(self, stmt, params=None, many=False, cursor_class=None):
+        if (cnx := getattr(self.local, 'cnx', None)) is not None:
+            return self.run(cnx, stmt, params, many, cursor_class)
+
+        with self.pool.get_connection() as cnx:
+            return self.run(cnx, stmt, params, many, cursor_class)
+
+    def upsert(self, table, stmt, params):
+        '''
+        Esegue un upsert multiplo e ritorna le righe inserite e quelle
+        aggiornate. Le righe inserite sono quelle senza chiave duplicata
+        nel messaggio "Records: N  Duplicates: D" del server; ogni riga
+        aggiornata vale UPSERT_ROWCOUNT nel conteggio, una riga invariata
+        zero. Per una sola riga il server non invia il messaggio.
+        '''
+        cur = self.execute(stmt, params, many=True, cursor_class=InfoCursor)
+
+        if (match := INSERT_INFO.search(cur.info)) is not None:
+            records, duplicates = map(int, match.groups())
+            inserted = records - duplicates
+        else:
+            inserted = int(cur.rowcount == 1)
+
+        return inserted, (cur.rowcount - inserted) // stmts.UPSERT_ROWCOUNT
+
+    def apply_settings(self, cnx, settings, restore=False):
+        '''
+        Applica alla sessione le impostazioni permesse dal server e
+        ritorna i valori precedenti di quelle applicate. Le impostazioni
+        rifiutate non vengono più applicate alle sessioni successive, a
+        meno che l'errore avvenga ripristinando i valori con "restore".
+        '''
+        previous = {}
+
+        for name, value in settings.items():
+            if name in self.refused:
+                continue
+
+            try:
+                row = self.run(
+                    cnx, stmts.GET_SESSION_VARIABLE.format(name)).fetchone()
+                self.run(cnx, stmts.SET_SESSION_VARIABLE.format(name), (value,))
+
+            except errors.Error as err:
+                logging.warning('session setting "%s" not %s: %s', name,
+                                'restored' if restore else 'applied', err.msg)
+
+                if not restore:
+                    self.refused.add(name)
+
+                continue
+
+            previous[name] = row['value']
+
+        return previous
+
+    @contextmanager
+    def session(self):
+        '''
+        Esegue tutte le istruzioni del thread corrente con una sola
+        connessione del pool, in transazioni confermate da "commit" ed
+        al termine del blocco; in caso di errore l'ultima transazione
+        viene annullata. Le impostazioni della sessione vengono
+        ripristinate prima di restituire la connessione al pool.
+        '''
+        if getattr(self.local, 'cnx', None) is not None:
+            yield
+            return
+
+        with self.pool.get_connection() as cnx:
+            previous = self.apply_settings(cnx, self.settings)
+
+            self.local.cnx = cnx
+            cnx.start_transaction()
+
+            try:
+                yield
+                cnx.commit()
+
+            except BaseException:
+                cnx.rollback()
+                raise
+
+            finally:
+                self.local.cnx = None
+                self.apply_settings(cnx, previous, restore=True)
+
+    def commit(self):
+        '''
+        Conferma la transazione della sessione del thread corrente e ne
+        apre una nuova.
+        '''
+        if (cnx := getattr(self.local, 'cnx', None)) is not None:
+            cnx.commit()
+            cnx.start_transaction()
+
+    def stream(self, stmt, params=None, size=10_000):
+        '''
+        Esegue una query restituendo le righe una alla volta, senza
+        caricare l'intero risultato in memoria.
+        '''
+        with self.pool.get_connection() as cnx:
+            with cnx.cursor(buffered=False) as cur:
+                cur.execute(stmt, params)
+
+                while (rows := cur.fetchmany(size)):
+                    yield from rows
+
 
 class Operations:
-    def __init__(self, database):
+    def __init__(self, database, infile=(), dedup=(), fresh=False,
+                 parsers=1, partition=False, swap=(), mirror=None, upsert=()):
         self.database = database
+        self.sql = database.statements
         self.columns = ()
+        self.infile = frozenset(infile)
+        self.dedup = frozenset(dedup)
+        self.fresh = fresh
+        self.hashes = {}
+        self.fingerprints = {}
+        self.deferred = {}
+        self.parsers = parsers
+        self.pool = None
+        self.partitioned = frozenset(stmts.PARTITIONS if partition else ())
+        self.swap = frozenset(swap)
+        self.shadows = set()
+        self.mirror = mirror
+        self.upsert = frozenset(upsert)
+
+        unsupported = (('infile', self.sql.LOAD_INFILE),
+                       ('partitioned', self.sql.PARTITION_BY),
+                       ('swap', self.sql.SWAP_TABLES))
+
+        for option, stmt in unsupported:
+            if getattr(self, option) and stmt is None:
+                logging.warning('"%s" not supported by the database', option)
+                setattr(self, option, frozenset())
+
+        for table in sorted(self.upsert - set(stmts.NATURAL_KEYS)):
+            logging.warning('"%s" has no natural key, not upserted', table)
+
+        for table in sorted(self.upsert & self.infile):
+            logging.warning('"%s" upserted with INSERT, not LOAD DATA', table)
+
+        self.upsert &= set(stmts.NATURAL_KEYS)
+        self.infile -= self.upsert
+
+        if parsers > 1:
+            self.pool = ProcessPoolExecutor(
+                max_workers=parsers, mp_context=get_context('spawn'))
+
+        max_packet = self.database.execute(
+            self.sql.GET_MAX_PACKET).fetchone()['max_allowed_packet']
+        self.max_bytes = min(stmts.BATCH_BYTES, max_packet // 2)
 
         try:
-            self.loaded = tuple(
-                row['file_name'] for row in self.database.execute(
-                    stmts.GET_LOADED))
+            rows = [row for row in self.database.execute(self.sql.GET_LOADED)
+                    if self.target(row['table_name'].removesuffix(
+                        stmts.SHADOW_SUFFIX)) == row['table_name']]
+
+            self.loaded = {row['file_name'] for row in rows}
+
+            # tabelle ombra caricate da un'esecuzione interrotta prima dello
+            # scambio: vengono completate e scambiate anche se tutti i loro
+            # file risultano già caricati
+            for table in self.swap:
+                if any(row['table_name'] == self.target(table) for row in rows):
+                    self.shadows.add(table)
+                    self.deferred[table] = (
+                        stmts.CREATE_TABLES if table in stmts.CREATE_TABLES
+                        else stmts.CREATE_USER_TABLES)
 
         except errors.Error as err:
             if err.errno == errorcode.ER_NO_SUCH_TABLE:
-                self.database.execute(stmts.CREATE_LOADED)
-                self.loaded = ()
+                self.database.execute(self.sql.CREATE_LOADED)
+                self.loaded = set()
 
                 logging.info('create "loaded"')
 
@@ -53,108 +465,580 @@ class Operations:
                 logging.exception(err)
                 sys.exit(1)
 
+        self.database.execute(self.sql.CREATE_PROGRESS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''
+        Termina i processi usati per la decodifica con --parsers.
+        '''
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def fork(self):
+        '''
+        Ritorna una copia che condivide il database ed il registro dei
+        file caricati ma con uno stato proprio per la tabella in
+        lavorazione, così da poter caricare più tabelle in parallelo.
+        '''
+        ops = copy.copy(self)
+        ops.columns = ()
+
+        return ops
+
+    def target(self, table):
+        '''
+        Ritorna la tabella in cui vengono inseriti i dati di "table": la
+        tabella ombra "<table>__new" per le tabelle indicate in "swap".
+        '''
+        if table in self.swap:
+            return table + stmts.SHADOW_SUFFIX
+
+        return table
+
     def get_columns(self, table):
         '''
         Ritorna le colonne contenute in una tabella.
         '''
         return tuple(row['COLUMN_NAME'] for row in self.database.execute(
-            stmts.GET_TABLE_COLUMNS, (table,)))
+            self.sql.GET_TABLE_COLUMNS, (table,)))
+
+    def get_hashes(self, table):
+        '''
+        Ritorna le impronte delle righe presenti nella tabella, lette
+        una sola volta per tabella dalla colonna "<table>_hash".
+        '''
+        if table not in self.hashes:
+            stmt = self.sql.GET_HASHES.format(table, self.target(table), table)
+            rows = self.database.stream(stmt)
+
+            self.hashes[table] = HashSet(bytes(row[0]) for row in rows)
+
+            logging.info('%s hashes from "%s"', len(self.hashes[table]), table)
+
+        return self.hashes[table]
+
+    def get_fingerprint(self, table):
+        '''
+        Ritorna il calcolo delle impronte per le colonne della tabella,
+        creato una sola volta per tabella.
+        '''
+        if table not in self.fingerprints:
+            types = {row['COLUMN_NAME']: row['DATA_TYPE'] for row in
+                     self.database.execute(
+                         self.sql.GET_COLUMN_TYPES, (self.target(table),))}
+
+            self.fingerprints[table] = Fingerprint(self.columns, types)
+
+        return self.fingerprints[table]
+
+    def skip_known(self, reader, table):
+        '''
+        Scarta prima dell'invio le righe già presenti nella tabella o già
+        lette durante il caricamento, confrontando l'impronta calcolata
+        lato client con quelle della colonna "<table>_hash".
+        '''
+        fingerprint = self.get_fingerprint(table)
+        known = self.get_hashes(table)
+
+        skipped = 0
+        for row in reader:
+            if (digest := fingerprint(row)) is not None:
+                if digest in known:
+                    skipped += 1
+                    continue
+
+                known.add(digest)
+
+            yield row
+
+        logging.info('%s known rows skipped', skipped)
 
     @staticmethod
-    def get_rows(file, refcols):
+    def get_rows(file, refcols, block=stmts.DECODE_BLOCK, stats=None,
+                 pool=None, ahead=1):
         '''
         Il generatore crea pacchetti di righe da inserire nel db usando
         il metodo executemany() previsto dal connettore MySQL. Seleziona solo
         le colonne presenti anche nel database (a volte nei files vengono
-        aggiunte delle nuove colonne non presenti nel db o con nomi differenti).
+        aggiunte delle nuove colonne non presenti nel db o con nomi differenti)
+        e ritorna le righe come tuple con i valori nell'ordine di "refcols".
         Inoltre assicura che i campi vuoti siano avvalorati correttamente in
         "None" in modo che il connettore li traduca in NULL durante l'inserimento.
+        Le righe vengono decodificate a blocchi di "block" righe, oppure una
+        alla volta se "block" è nullo; in "stats" vengono sommati i tempi di
+        lettura e di decodifica dei blocchi. Con "pool" la decodifica dei
+        blocchi avviene nei processi del pool, con al massimo "ahead"
+        blocchi in lavorazione.
         '''
-        def fix(row):
-            select = {}
+        stats = Counter() if stats is None else stats
 
-            for k in sorted(row, key=len):
-                _k = k.replace('-', '_')
+        if pool is not None:
+            return parse_blocks(file, refcols, block, stats, pool, ahead)
 
-                if refcols:
-                    for col in sorted(refcols, key=len, reverse=True):
-                        starts = _k.lower().startswith(col.lower())
+        fix = RowMapper(refcols)
 
-                        if starts and col not in select:
-                            select[col] = row[k] or None
-                            break
+        def read_blocks():
+            while True:
+                start = time.perf_counter()
+                lines = list(islice(file, block))
+                stats['unzip_seconds'] += time.perf_counter() - start
 
-                else:
-                    select[_k] = row[k] or None
+                if not lines:
+                    return
+
+                start = time.perf_counter()
+                rows = [fix(row) for row in decode_block(lines)]
+                stats['parse_seconds'] += time.perf_counter() - start
+                stats['parse_rows'] += len(rows)
+
+                yield from rows
 
-            return select
+        if block:
+            return read_blocks()
 
-        return (json.loads(row, object_hook=fix) for row in file)
+        return (fix(loads(line)) for line in file)
 
     @staticmethod
-    def get_batches(reader, batch_size):
-        while (batch := tuple(islice(reader, batch_size))):
-            yield batch
+    def get_batches(reader, sizer):
+        return get_batches(reader, sizer)
 
     def create(self, statements, table, hash=False, key=True):
         '''
         Crea le tabelle qualora non siano già presenti nel db. Eventualmente
-        aggiunge "id" primary key ed "hash" unique key.
+        aggiunge "id" primary key ed "hash" unique key. In modalità "fresh"
+        e per le tabelle ombra gli indici secondari vengono rimandati alla
+        fine del caricamento; se il database non li accetta nel DDL vengono
+        creati subito dopo la tabella. Anche per le tabelle già presenti
+        vengono aggiunti alla fine gli indici mancanti, ad esempio dopo un
+        caricamento con "fresh" interrotto.
         '''
+        target = self.target(table)
+        ddl = rename_table(statements[table], target)
+
+        defer = self.fresh or table in self.swap
+
+        if defer or not self.database.inline_keys:
+            ddl, _ = split_keys(ddl)
+
+        if defer:
+            self.deferred[table] = statements
+
+        if table in self.swap:
+            self.shadows.add(table)
+
         try:
-            self.database.execute(statements[table])
+            self.database.execute(ddl)
 
         except errors.Error as err:
             if err.errno == errorcode.ER_TABLE_EXISTS_ERROR:
-                self.columns = self.get_columns(table)
+                self.columns = self.get_columns(target)
+                self.deferred.setdefault(table, statements)
+
+                if table in stmts.PARTITIONS and self.sql.PARTITION_BY:
+                    self.add_partitions(table)
 
             else:
                 logging.exception(err)
                 sys.exit(1)
 
         else:
-            self.columns = self.get_columns(table)
+            self.columns = self.get_columns(target)
 
-            logging.info('"%s"', table)
+            logging.info('"%s"', target)
 
-            if hash:
-                columns = ','.join(self.columns)
-                hash_stmt = stmts.HASH_KEY.format(table, table, columns)
+            if hash and key and table in self.partitioned:
+                self.partition(table)
 
-                self.database.execute(hash_stmt)
+            else:
+                self.add_hash_and_keys(statements, table, hash, key, defer)
 
-            if key:
-                pk_stmt = stmts.ADD_ID.format(table, table)
+        if table in self.upsert:
+            self.add_natural_key(table)
 
-                self.database.execute(pk_stmt)
+    def add_hash_and_keys(self, statements, table, hash, key, defer):
+        target = self.target(table)
 
-    def insert(self, table, data):
+        if hash:
+            columns = ','.join(self.columns)
+            hash_stmt = self.sql.HASH_KEY.format(target, table, columns)
+
+            self.database.execute(hash_stmt)
+
+        if key and self.sql.ADD_ID:
+            pk_stmt = self.sql.ADD_ID.format(target, table)
+
+            self.database.execute(pk_stmt)
+
+        if not (defer or self.database.inline_keys):
+            self.add_keys(statements, table)
+
+    def add_natural_key(self, table):
+        '''
+        Aggiunge la chiave unique sulle colonne di NATURAL_KEYS usata per
+        gli upsert, se non è già presente. Le tabelle partizionate non
+        vengono aggiornate: la chiave dovrebbe includere la colonna
+        "<table>_anno" e la correzione della data aggiungerebbe una nuova
+        versione della riga in un'altra partizione. L'operazione fallisce se
+        la tabella contiene più versioni della stessa riga, che può essere
+        ricaricata da zero con --swap.
+        '''
+        target = self.target(table)
+        name = f'{table}_natural'
+
+        existing = {row['INDEX_NAME'] for row in self.database.execute(
+            self.sql.GET_INDEXES, (target,))}
+
+        if name in existing:
+            return
+
+        if self.sql.PARTITION_BY and self.get_partitions(target):
+            logging.warning('"%s" is partitioned, not upserted', target)
+            self.upsert -= {table}
+            return
+
+        columns = ','.join(stmts.NATURAL_KEYS[table])
+        key = self.sql.NATURAL_KEY.format(name, columns, table=target)
+
+        try:
+            self.database.execute(self.sql.ALTER_TABLE.format(target, key))
+
+        except errors.Error as err:
+            if err.errno == errorcode.ER_DUP_ENTRY:
+                logging.error('"%s" has rows with the same natural key,'
+                              ' reload it with --swap', target)
+            else:
+                logging.exception(err)
+
+            sys.exit(1)
+
+        logging.info('natural key on "%s"', target)
+
+    def partition(self, table):
         '''
-        Esegue l'insert nel db.
+        Partiziona per anno una tabella appena creata. La colonna
+        "<table>_anno" deve far parte della primary key e della chiave
+        unique sull'hash, che restano equivalenti a quelle delle altre
+        tabelle perché l'anno è calcolato da una colonna inclusa nell'hash.
         '''
+        target = self.target(table)
         columns = ','.join(self.columns)
-        values = ','.join(f'%({c})s' for c in self.columns)
 
-        stmt = stmts.INSERT_TABLES.format(table, columns, values)
+        self.database.execute(self.sql.PARTITION_KEYS.format(
+            target, table, stmts.PARTITIONS[table], columns))
+
+        first, last = stmts.PARTITION_FIRST, date.today().year + 1
+        partitions = [self.sql.PARTITION.format(0, first),
+                      *self.get_year_partitions(first, last),
+                      self.sql.LAST_PARTITION]
+
+        self.database.execute(self.sql.PARTITION_BY.format(
+            target, table, ','.join(partitions)))
+
+        logging.info('"%s" partitioned up to %s', target, last)
+
+    def get_year_partitions(self, first, last):
+        return [self.sql.PARTITION.format(year, year + 1)
+                for year in range(first, last + 1)]
+
+    def get_partitions(self, table):
+        return {row['PARTITION_NAME'] for row in self.database.execute(
+            self.sql.GET_PARTITIONS, (table,))}
+
+    def add_partitions(self, table):
+        '''
+        Aggiunge ad una tabella partizionata le partizioni mancanti fino
+        all'anno successivo a quello corrente, dividendo "pmax".
+        '''
+        target = self.target(table)
+
+        if not (existing := self.get_partitions(target)):
+            return
+
+        years = [int(name[1:]) for name in existing if name[1:].isdigit()]
+        first, last = max(years) + 1, date.today().year + 1
+
+        if first > last:
+            return
+
+        partitions = [*self.get_year_partitions(first, last),
+                      self.sql.LAST_PARTITION]
+
+        self.database.execute(self.sql.REORGANIZE_PARTITION.format(
+            target, ','.join(partitions)))
+
+        logging.info('"%s" partitioned up to %s', target, last)
+
+    def reload(self, table, years):
+        '''
+        Svuota le partizioni degli anni indicati e rimuove dai registri i
+        file il cui nome contiene uno di quegli anni, così che vengano
+        caricati di nuovo senza confrontarli con il resto della tabella.
+        Gli anni senza file caricati con l'anno nel nome vengono ignorati,
+        perché le righe della partizione non verrebbero più inserite; per
+        lo stesso motivo l'anno nel nome dei file deve essere quello della
+        colonna di partizionamento.
+        '''
+        if self.sql.PARTITION_BY is None:
+            logging.warning('partitions not supported by the database')
+            return
+
+        existing = self.get_partitions(table)
+        loaded = [row['file_name'] for row in self.database.execute(
+            self.sql.GET_TABLE_LOADED, (table,))]
+
+        files = {}
+        for year in years:
+            pattern = re.compile(rf'(?<!\d){year}(?!\d)')
+
+            if f'p{year}' not in existing:
+                logging.warning('"%s" has no partition for %s', table, year)
+            elif not (names := [n for n in loaded if pattern.search(n)]):
+                logging.warning('"%s": no loaded file named after %s,'
+                                ' partition not reloaded', table, year)
+            else:
+                files[year] = names
+
+        if not files:
+            return
+
+        partitions = ','.join(f'p{year}' for year in files)
+        self.database.execute(
+            self.sql.TRUNCATE_PARTITION.format(table, partitions))
+
+        for name in sorted({n for names in files.values() for n in names}):
+            self.database.execute(self.sql.DELETE_LOADED, (table, name))
+            self.database.execute(self.sql.DELETE_PROGRESS, (table, name))
+            self.loaded.discard(name)
+
+            logging.info('"%s" will be reloaded', name)
+
+        self.hashes.pop(table, None)
+
+    def add_keys(self, statements, table):
+        '''
+        Aggiunge con un unico ALTER TABLE gli indici secondari definiti
+        nel DDL e non ancora presenti nella tabella.
+        '''
+        target = self.target(table)
+
+        existing = {row['INDEX_NAME'] for row in self.database.execute(
+            self.sql.GET_INDEXES, (target,))}
+
+        _, keys = split_keys(statements[table])
+        missing = [self.sql.ADD_KEY.format(name, columns, table=target)
+                   for name, columns in keys if name not in existing]
+
+        if missing:
+            logging.info('%s keys on "%s" ...', len(missing), target)
+
+            self.database.execute(self.sql.ALTER_TABLE.format(
+                target, self.sql.KEY_SEPARATOR.join(missing)))
+
+    def build_deferred_keys(self, tables):
+        '''
+        Crea gli indici rimandati per le tabelle indicate.
+        '''
+        for table in sorted(tables):
+            if (statements := self.deferred.pop(table, None)) is not None:
+                self.add_keys(statements, table)
+
+    def swap_tables(self, tables):
+        '''
+        Sostituisce le tabelle indicate con le rispettive tabelle ombra,
+        con un unico RENAME TABLE atomico, ed aggiorna il registro
+        "loaded" con i file caricati nelle tabelle ombra. Una tabella
+        "<table>__old" rimasta da uno scambio interrotto viene eliminata.
+        '''
+        for table in sorted(set(tables) & self.shadows):
+            shadow = self.target(table)
+
+            self.database.execute(self.sql.CREATE_LIKE.format(table, shadow))
+            self.database.execute(self.sql.DROP_TABLE.format(table))
+            self.database.execute(self.sql.SWAP_TABLES.format(table, shadow))
+            self.database.execute(self.sql.DROP_TABLE.format(table))
+
+            self.database.execute(self.sql.CLEAR_LOADED, (table,))
+            self.database.execute(self.sql.MOVE_LOADED, (table, shadow))
+
+            self.shadows.discard(table)
+
+            logging.info('"%s" swapped with "%s"', table, shadow)
+
+    def get_values(self, table, data):
+        '''
+        Ritorna le colonne e le righe da inviare. Se il database non calcola
+        la colonna "<table>_hash" l'impronta di ogni riga viene calcolata
+        lato client.
+        '''
+        columns = self.columns
+
+        if self.database.client_hash:
+            fingerprint = self.get_fingerprint(table)
+
+            data = [(*row, fingerprint.digest(row)) for row in data]
+            columns += (f'{table}_hash',)
+
+        return columns, data
+
+    def insert(self, table, data):
+        '''
+        Esegue l'insert nel db e ritorna le righe inserite.
+        '''
+        columns, data = self.get_values(table, data)
+        values = ','.join(['%s'] * len(columns))
+
+        stmt = self.sql.INSERT_TABLES.format(
+            self.target(table), ','.join(columns), values)
 
         rows = self.database.execute(stmt, data, many=True).rowcount
 
         return rows
 
-    def load(self, reader, table, name=None):
+    def upsert_rows(self, table, data):
+        '''
+        Inserisce le righe nuove ed aggiorna quelle presenti con la stessa
+        chiave naturale ma con valori diversi, con un'unica istruzione per
+        pacchetto. Ritorna le righe inserite e quelle aggiornate.
+        '''
+        columns, data = self.get_values(table, data)
+        values = ','.join(['%s'] * len(columns))
+
+        same = ' AND '.join(self.sql.UPSERT_SAME.format(col)
+                            for col in columns)
+        update = ','.join(self.sql.UPSERT_COLUMN.format(col)
+                          for col in columns)
+
+        stmt = self.sql.UPSERT_TABLES.format(
+            self.target(table), ','.join(columns), values, same, update,
+            key=','.join(stmts.NATURAL_KEYS[table]))
+
+        return self.database.upsert(self.target(table), stmt, data)
+
+    def insert_infile(self, table, data):
+        '''
+        Esegue l'inserimento con LOAD DATA LOCAL INFILE, scrivendo le
+        righe in un file temporaneo in formato tsv.
+        '''
+        with tempfile.NamedTemporaryFile(
+                'w', encoding='utf-8', newline='\n', suffix='.tsv',
+                delete=False) as file:
+
+            for row in data:
+                file.write('\t'.join(map(to_tsv, row)))
+                file.write('\n')
+
+        try:
+            columns = ','.join(self.columns)
+            stmt = self.sql.LOAD_INFILE.format(self.target(table), columns)
+
+            rows = self.database.execute(stmt, (file.name,)).rowcount
+
+        finally:
+            os.remove(file.name)
+
+        return rows
+
+    def skip_rows(self, file, rows):
+        '''
+        Salta le righe già caricate senza decodificarle. Con "mirror" le
+        righe vengono invece decodificate e saltate da "load" dopo averle
+        copiate, così che la copia Parquet contenga tutto il file.
+        '''
+        if self.mirror is not None:
+            return file
+
+        return skip_rows(file, rows)
+
+    def get_progress(self, table, name):
+        '''
+        Ritorna le righe del file già lette e quelle inserite nel db
+        durante un caricamento precedente interrotto.
+        '''
+        progress = (self.target(table), name)
+
+        for row in self.database.execute(self.sql.GET_PROGRESS, progress):
+            logging.info('"%s" resumes from row %s', name, row['line_offset'])
+
+            return row['line_offset'], row['row_count']
+
+        return 0, 0
+
+    def load(self, reader, table, name=None, offset=0, done=0):
         '''
         Gestisce l'inserimento dei file ed aggiorna la tabella "loaded".
+        Dopo ogni pacchetto salva in "loaded_progress" le righe lette e
+        quelle inserite, in modo che un caricamento interrotto riparta
+        dalla riga "offset" avendone già inserite "done". Il file viene
+        caricato con una sola connessione, confermando insieme ogni
+        "COMMIT_BATCHES" pacchetti ed il relativo progresso. Con "mirror"
+        tutte le righe vengono copiate in Parquet: il reader, ottenuto con
+        "skip_rows", contiene anche le prime "offset" righe, che non
+        vengono inserite.
         '''
         name = name or ''
         quoted_name = f'"{name}" '
-        logging.info('%sinto "%s" ...', name and quoted_name, table)
+        target = self.target(table)
+        logging.info('%sinto "%s" ...', name and quoted_name, target)
+
+        stats = metrics.record(table, name)
+
+        if self.mirror is not None:
+            reader = self.mirror.write(reader, table, name, self.columns)
+            reader = islice(reader, offset, None)
+
+        reader = counter = RowCounter(reader, offset)
+
+        if table in self.dedup:
+            reader = self.skip_known(reader, table)
+
+        sizer = BatchSizer(self.max_bytes)
+        batches = self.get_batches(reader, sizer)
+
+        insert = self.insert_infile if table in self.infile else self.insert
+
+        rows = updated = 0
+        with self.database.session():
+            for count, batch in enumerate(tqdm(batches, unit=' batch'), 1):
+                start = time.perf_counter()
+
+                if table in self.upsert:
+                    inserted, changed = self.upsert_rows(table, batch)
+
+                    updated += changed
+                    stats['update_rows'] += changed
+                else:
+                    inserted = insert(table, batch)
+
+                seconds = time.perf_counter() - start
+
+                rows += inserted
+                sizer.update(len(batch), seconds)
+
+                self.database.execute(self.sql.SET_PROGRESS,
+                                      (target, name, counter.count, done + rows))
+
+                if not count % stmts.COMMIT_BATCHES:
+                    self.database.commit()
+                    stats['round_trips'] += 1
+
+                stats['sent_rows'] += len(batch)
+                stats['insert_rows'] += inserted
+                stats['insert_seconds'] += seconds
+                stats['round_trips'] += 2
 
-        batches = self.get_batches(reader, stmts.BATCH_SIZE)
+            self.database.execute(self.sql.INSERT_LOADED, (target, name))
+            self.database.execute(self.sql.DELETE_PROGRESS, (target, name))
 
-        rows = 0
-        for batch in tqdm(batches, unit=' batch'):
-            rows += self.insert(table, batch)
+        if table in self.upsert:
+            logging.info('%s rows updated in "%s"', updated, target)
 
-        self.database.execute(stmts.INSERT_LOADED, (table, name))
+        self.loaded.add(name)
 
         return rows
@@ -0,0 +1,77 @@
+import json
+import threading
+from collections import Counter
+
+RATES = (('parse_rows', 'parse_seconds'),
+         ('insert_rows', 'insert_seconds'),
+         ('download_bytes', 'download_seconds'))
+
+
+class Metrics:
+    '''
+    Raccoglie per ogni tabella e risorsa i tempi e le quantità delle fasi
+    del caricamento: download, decompressione, decodifica ed inserimento.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = {}
+
+    def record(self, table, name):
+        '''
+        Ritorna il contatore associato alla risorsa, creandolo se assente.
+        '''
+        with self.lock:
+            return self.records.setdefault((table, name), Counter())
+
+    def report(self):
+        '''
+        Ritorna le misure raccolte, con le velocità di ciascuna fase e le
+        righe scartate dal database perché duplicate.
+        '''
+        report = []
+
+        for (table, name), counter in self.records.items():
+            entry = {'table': table, 'resource': name, **counter}
+            entry['ignored_rows'] = (counter['sent_rows'] -
+                                     counter['insert_rows'] -
+                                     counter['update_rows'])
+
+            for amount, seconds in RATES:
+                if counter[seconds]:
+                    rate = amount.replace('_rows', '_rows_per_second')
+                    rate = rate.replace('_bytes', '_bytes_per_second')
+                    entry[rate] = round(counter[amount] / counter[seconds], 1)
+
+            report.append(entry)
+
+        return report
+
+    def write(self, path, prometheus=None):
+        '''
+        Salva le misure in formato json e, se richiesto, nel formato
+        testuale di Prometheus.
+        '''
+        report = self.report()
+
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+
+        if not prometheus:
+            return
+
+        samples = {}
+        for entry in report:
+            labels = f'table="{entry["table"]}",resource="{entry["resource"]}"'
+
+            for key, value in entry.items():
+                if key not in ('table', 'resource'):
+                    samples.setdefault(key, []).append(
+                        f'anac_{key}{{{labels}}} {value}')
+
+        with open(prometheus, 'w') as file:
+            for key, lines in samples.items():
+                file.write(f'# TYPE anac_{key} gauge\n')
+                file.writelines(f'{line}\n' for line in lines)
+
+
+metrics = Metrics()
@@ -0,0 +1,214 @@
+import glob
+import json
+import logging
+import os
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from anac import statements as stmts
+from anac.ddl import parse_columns
+from anac.dedup import INTEGER_TYPES
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+SCHEMA = stmts.CREATE_TABLES | stmts.CREATE_USER_TABLES
+
+# anno ed eventualmente mese nel nome dei file, es. "cig_json_2023_01"
+PERIOD = re.compile(r'(?<!\d)(\d{4})(?:[_-](\d{2}))?(?!\d)')
+
+
+# le conversioni seguono quelle di MySQL: i decimali vengono arrotondati
+# all'intero più vicino (metà lontano dallo zero) ed i secondi frazionari
+# al secondo più vicino; i valori non convertibili diventano None
+def to_integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+
+    try:
+        return int(Decimal(str(value)).quantize(0, ROUND_HALF_UP))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def to_double(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_timestamp(value):
+    try:
+        value = datetime.fromisoformat(str(value).replace('Z', ''))
+    except ValueError:
+        return None
+
+    if value.microsecond >= 500_000:
+        value += timedelta(seconds=1)
+
+    return value.replace(microsecond=0, tzinfo=None)
+
+
+def to_string(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+
+    if isinstance(value, bool):
+        return str(int(value))
+
+    return str(value)
+
+
+def get_types():
+    types = {'double': (pa.float64(), to_double),
+             'float': (pa.float64(), to_double),
+             'datetime': (pa.timestamp('s'), to_timestamp)}
+    types.update(dict.fromkeys(INTEGER_TYPES, (pa.int64(), to_integer)))
+
+    return types
+
+
+class Mirror:
+    '''
+    Copia in formato Parquet delle risorse caricate, un file per risorsa
+    in "<path>/<table>/year=<anno>/month=<mese>/", con l'anno ed il mese
+    ricavati dal nome del file. Le colonne hanno l'ordine delle tabelle
+    ed i tipi definiti nel DDL, così che una tabella possa essere
+    ricostruita senza scaricare e decodificare di nuovo i file json.
+    I valori che non è possibile convertire nel tipo della colonna
+    vengono scritti come NULL e contati nel log.
+    '''
+    def __init__(self, path, rows=stmts.MIRROR_ROWS):
+        if pa is None:
+            raise ImportError('the Parquet mirror requires "pyarrow"')
+
+        self.path = path
+        self.rows = rows
+        self.types = get_types()
+
+    def get_path(self, table, name):
+        stem = os.path.splitext(os.path.basename(name))[0]
+
+        if (match := PERIOD.search(stem)):
+            year, month = match[1], match[2] or '00'
+        else:
+            year, month = '0000', '00'
+
+        return os.path.join(self.path, table, f'year={year}', f'month={month}',
+                            f'{stem}.parquet')
+
+    def get_schema(self, table, columns):
+        '''
+        Ritorna lo schema Parquet delle colonne, con i tipi del DDL ed i
+        convertitori dei valori letti dai file json.
+        '''
+        kinds = {name: kind for name, kind, _ in parse_columns(SCHEMA[table])}
+        string = (pa.string(), to_string)
+
+        types = [self.types.get(kinds.get(col), string) for col in columns]
+        schema = pa.schema([(col, kind) for col, (kind, _) in zip(columns, types)])
+
+        return schema, [convert for _, convert in types]
+
+    def write(self, reader, table, name, columns):
+        '''
+        Ritorna le righe del reader scrivendole nel file Parquet della
+        risorsa. Il file viene scritto con estensione ".part" e rinominato
+        solo quando tutte le righe sono state lette.
+        '''
+        schema, converters = self.get_schema(table, columns)
+
+        path = self.get_path(table, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        nulled = Counter()
+
+        def flush(writer, rows):
+            arrays = []
+            for values, convert, field in zip(zip(*rows), converters, schema):
+                converted = [None if value is None else convert(value)
+                             for value in values]
+
+                nulled[field.name] += sum(
+                    value is not None and new is None
+                    for value, new in zip(values, converted))
+
+                arrays.append(pa.array(converted, type=field.type))
+
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+
+        completed = False
+        writer = pq.ParquetWriter(f'{path}.part', schema)
+
+        try:
+            rows = []
+            for row in reader:
+                rows.append(row)
+
+                if len(rows) >= self.rows:
+                    flush(writer, rows)
+                    rows = []
+
+                yield row
+
+            if rows:
+                flush(writer, rows)
+
+            completed = True
+
+        finally:
+            writer.close()
+
+            if completed:
+                os.replace(f'{path}.part', path)
+
+                logging.info('"%s" mirrored', path)
+
+                if (nulled := +nulled):
+                    logging.warning('"%s": values written as NULL: %s',
+                                    path, dict(nulled))
+
+            else:
+                os.remove(f'{path}.part')
+
+    def get_tables(self):
+        if not os.path.isdir(self.path):
+            return []
+
+        return sorted(entry.name for entry in os.scandir(self.path)
+                      if entry.is_dir() and entry.name in SCHEMA)
+
+    def get_files(self, table):
+        '''
+        Ritorna le coppie (file Parquet, nome della risorsa) di una tabella.
+        '''
+        pattern = os.path.join(self.path, table, '*', '*', '*.parquet')
+
+        for path in sorted(glob.glob(pattern)):
+            stem = os.path.splitext(os.path.basename(path))[0]
+
+            yield path, f'{stem}.json'
+
+    @staticmethod
+    def read(path, columns):
+        '''
+        Ritorna le righe del file come tuple nell'ordine di "columns";
+        le colonne assenti nel file valgono None.
+        '''
+        file = pq.ParquetFile(path)
+        names = file.schema_arrow.names
+
+        for batch in file.iter_batches(columns=[c for c in columns if c in names]):
+            data = {name: batch.column(name).to_pylist()
+                    for name in batch.schema.names}
+            nulls = [None] * batch.num_rows
+
+            yield from zip(*(data.get(col, nulls) for col in columns))
@@ -0,0 +1,44 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+_END = object()
+
+
+def prefetch(func, items, depth, max_bytes, size=lambda item: 0):
+    '''
+    Esegue "func" sugli elementi in un pool di thread mantenendo, oltre
+    a quello in uso, al massimo "depth" elementi in lavorazione o in
+    attesa di essere consumati ed al massimo "max_bytes" byte (stimati da
+    "size"). Con "depth" nullo gli elementi vengono elaborati uno alla
+    volta. Ritorna le coppie (elemento, risultato) nell'ordine originale.
+    '''
+    items = iter(items)
+    pending = deque()
+    held = 0
+    depth = max(depth, 0)
+
+    pool = ThreadPoolExecutor(max_workers=depth + 1)
+
+    try:
+        item = next(items, _END)
+
+        while pending or item is not _END:
+            while item is not _END and len(pending) <= depth:
+                weight = size(item)
+
+                if pending and held + weight > max_bytes:
+                    break
+
+                pending.append((item, weight, pool.submit(func, item)))
+                held += weight
+
+                item = next(items, _END)
+
+            current, weight, future = pending.popleft()
+
+            yield current, future.result()
+
+            held -= weight
+
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
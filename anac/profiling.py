@@ -0,0 +1,117 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from anac import statements as stmts
+
+
+class Sampler(threading.Thread):
+    '''
+    Profilatore a campionamento: ogni "interval" secondi registra lo stack
+    del thread osservato. Il costo è indipendente dal numero di chiamate,
+    quindi può restare attivo anche nei caricamenti ordinari.
+    '''
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f'{code.co_name} ({os.path.basename(code.co_filename)})')
+                frame = frame.f_back
+
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Profiles:
+    '''
+    Raccoglie i profili delle fasi del caricamento, uno per ogni chiave
+    (ad esempio il nome della tabella). Con "cprofile" usa il profilatore
+    deterministico della libreria standard, con "sample" il campionamento.
+    Un solo profilatore deterministico può essere attivo nel processo (da
+    Python 3.12 attivarne un secondo solleva ValueError): viene usato solo
+    nel thread principale, mentre gli altri thread, come quelli dei
+    download anticipati e di --jobs, vengono campionati.
+    '''
+    def __init__(self, mode=None, interval=stmts.PROFILE_INTERVAL):
+        self.mode = mode
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.stacks = {}
+        self.active = False
+
+    @contextmanager
+    def profile(self, key):
+        '''
+        Profila il blocco sommando il risultato a quello della chiave.
+        '''
+        main = threading.current_thread() is threading.main_thread()
+
+        if self.mode == 'cprofile' and main and not self.active:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            self.active = True
+
+            try:
+                yield
+            finally:
+                profiler.disable()
+                self.active = False
+
+                with self.lock:
+                    if key in self.stats:
+                        self.stats[key].add(profiler)
+                    else:
+                        self.stats[key] = pstats.Stats(profiler)
+
+        elif self.mode in ('cprofile', 'sample'):
+            sampler = Sampler(threading.get_ident(), self.interval)
+            sampler.start()
+
+            try:
+                yield
+            finally:
+                sampler.stop()
+
+                with self.lock:
+                    self.stacks.setdefault(key, Counter()).update(
+                        sampler.stacks)
+
+        else:
+            yield
+
+    def dump(self, base):
+        '''
+        Salva i profili come "<base>_<chiave>.prof", leggibili con pstats,
+        e gli stack campionati come "<base>_<chiave>.folded", nel formato
+        usato dai flame graph.
+        '''
+        for key, stats in self.stats.items():
+            stats.dump_stats(f'{base}_{key}.prof')
+
+        for key, stacks in self.stacks.items():
+            with open(f'{base}_{key}.folded', 'w') as file:
+                file.writelines(
+                    f'{stack} {count}\n' for stack, count in stacks.items())
+
+
+profiles = Profiles()
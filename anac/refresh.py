@@ -0,0 +1,60 @@
+def version(res):
+    '''
+    Ritorna la versione di una risorsa: date di modifica e dimensione.
+    '''
+    size = res.get('size')
+    size = int(size) if size not in (None, '') else None
+
+    return res.get('last_modified'), res.get('metadata_modified'), size
+
+
+class Watermarks:
+    '''
+    Registro delle versioni dei packages e delle risorse del portale già
+    elaborate, usato dal comando "refresh" per elaborare solo quelle
+    nuove o modificate.
+    '''
+    def __init__(self, database):
+        self.database = database
+        self.sql = database.statements
+        self.pending = {}
+
+        self.database.execute(self.sql.CREATE_PACKAGES)
+        self.database.execute(self.sql.CREATE_RESOURCES)
+
+        self.packages = {
+            row['package_name']: row['metadata_modified']
+            for row in self.database.execute(self.sql.GET_PACKAGES)}
+
+        self.resources = {
+            row['resource_id']: version(row)
+            for row in self.database.execute(self.sql.GET_RESOURCES)}
+
+    def package_changed(self, pack):
+        '''
+        Verifica se il package è stato modificato dall'ultima elaborazione
+        e ne conserva la versione fino alla chiamata di "set_package".
+        '''
+        self.pending[pack['name']] = pack.get('metadata_modified')
+
+        return self.packages.get(pack['name']) != pack.get('metadata_modified')
+
+    def resource_changed(self, res):
+        return self.resources.get(res['id']) != version(res)
+
+    def set_resource(self, table, pack, res):
+        last_modified, metadata_modified, size = version(res)
+
+        self.database.execute(self.sql.SET_RESOURCE, (
+            res['id'], pack, table, f'{res["name"]}.json',
+            last_modified, metadata_modified, size))
+
+        self.resources[res['id']] = version(res)
+
+    def set_package(self, pack):
+        if (modified := self.pending.pop(pack, None)) is None:
+            return
+
+        self.database.execute(self.sql.SET_PACKAGE, (pack, modified))
+
+        self.packages[pack] = modified
@@ -0,0 +1,108 @@
+import logging
+import sys
+from datetime import timedelta
+
+from mysql.connector import errors
+
+from anac import statements as stmts
+
+
+class Sintesi:
+    '''
+    Tabella "sintesi", che unisce "cig", "aggiudicazioni", "aggiudicatari"
+    e "province", e vista "sintesi_cpv" con le descrizioni dei cpv. Ad
+    ogni aggiornamento vengono ricalcolati solo i cig con righe inserite
+    dopo il watermark salvato in "summary_marks".
+    '''
+    name = 'sintesi'
+
+    def __init__(self, database):
+        self.database = database
+
+    def setup(self):
+        for stmt in (stmts.CREATE_SUMMARY_MARKS, stmts.CREATE_SINTESI,
+                     stmts.CREATE_SINTESI_CPV):
+            self.database.execute(stmt)
+
+    def get_watermark(self, margin=stmts.SINTESI_MARGIN):
+        '''
+        Ritorna il watermark precedente anticipato di "margin" secondi, così
+        che vengano elaborate anche le righe inserite prima del watermark
+        ma confermate dopo l'aggiornamento precedente.
+        '''
+        for row in self.database.execute(
+                stmts.GET_SUMMARY_MARK, (self.name,)):
+            return row['watermark'] - timedelta(seconds=margin)
+
+        return None
+
+    def fill(self, table, start, end):
+        '''
+        Ricalcola in "table" i cig con righe inserite fra "start" ed "end",
+        elencati nella tabella temporanea "sintesi_delta". Ritorna i cig,
+        le righe eliminate e quelle inserite.
+        '''
+        self.database.execute(stmts.DROP_SINTESI_DELTA)
+        self.database.execute(stmts.CREATE_SINTESI_DELTA)
+
+        changed = self.database.execute(
+            stmts.SET_SINTESI_DELTA, {'start': start, 'end': end}).rowcount
+        deleted = self.database.execute(
+            stmts.DELETE_SINTESI.format(table)).rowcount
+        inserted = self.database.execute(
+            stmts.INSERT_SINTESI.format(table)).rowcount
+
+        self.database.execute(stmts.DROP_SINTESI_DELTA)
+
+        return changed, deleted, inserted
+
+    def update(self, full=False):
+        '''
+        Aggiorna la tabella elaborando le righe inserite nelle tabelle di
+        origine fra il watermark precedente, meno SINTESI_MARGIN secondi,
+        e l'inizio dell'aggiornamento; i cig già elaborati vengono
+        ricalcolati senza duplicare le righe, in un'unica transazione
+        insieme al nuovo watermark.
+        Con "full" la tabella viene ricostruita da zero in una tabella
+        ombra, scambiata con un RENAME TABLE atomico, così che resti
+        consultabile durante l'operazione.
+        '''
+        target = self.name + stmts.SHADOW_SUFFIX if full else self.name
+
+        try:
+            self.setup()
+
+            if full:
+                self.database.execute(stmts.DROP_SINTESI_SHADOW)
+                self.database.execute(
+                    stmts.CREATE_LIKE.format(target, self.name))
+
+            with self.database.session():
+                start = None if full else self.get_watermark()
+                start = start or stmts.SINTESI_START
+                end = self.database.execute(stmts.GET_NOW).fetchone()['now']
+
+                logging.info('"%s" from %s to %s ...', target, start, end)
+
+                changed, deleted, inserted = self.fill(target, start, end)
+
+                if not full:
+                    self.database.execute(
+                        stmts.SET_SUMMARY_MARK, (self.name, end))
+
+            if full:
+                self.database.execute(stmts.DROP_TABLE.format(self.name))
+                self.database.execute(
+                    stmts.SWAP_TABLES.format(self.name, target))
+                self.database.execute(stmts.DROP_TABLE.format(self.name))
+
+                self.database.execute(stmts.SET_SUMMARY_MARK, (self.name, end))
+
+        except errors.Error as err:
+            logging.exception(err)
+            sys.exit(1)
+
+        logging.info('%s cig changed: %s rows deleted, %s inserted',
+                     changed, deleted, inserted)
+
+        return inserted
@@ -0,0 +1,337 @@
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from mysql.connector import errorcode, errors
+
+from anac import statements as stmts
+
+# istruzioni di statements.py, sostituite dove SQLite ha una sintassi
+# diversa; le altre vengono adattate da "translate"
+STATEMENTS = SimpleNamespace(**{
+    name: value for name, value in vars(stmts).items() if name.isupper()})
+
+STATEMENTS.GET_TABLE_COLUMNS = '''
+    SELECT
+        name AS COLUMN_NAME
+    FROM
+        pragma_table_info(%s)
+    WHERE
+        IFNULL(dflt_value, '') NOT LIKE '%CURRENT_TIMESTAMP%' AND
+        name NOT LIKE '%\\_hash' ESCAPE '\\'
+    '''
+
+STATEMENTS.GET_COLUMN_TYPES = '''
+    SELECT
+        name AS COLUMN_NAME,
+        LOWER(SUBSTR(type, 1, MIN(INSTR(type || ' ', ' '),
+                                  INSTR(type || '(', '(')) - 1)) AS DATA_TYPE
+    FROM
+        pragma_table_info(%s)
+    WHERE
+        IFNULL(dflt_value, '') NOT LIKE '%CURRENT_TIMESTAMP%' AND
+        name NOT LIKE '%\\_hash' ESCAPE '\\'
+    '''
+
+STATEMENTS.GET_MAX_PACKET = 'SELECT 1073741824 AS max_allowed_packet'
+
+STATEMENTS.GET_INDEXES = 'SELECT name AS INDEX_NAME FROM pragma_index_list(%s)'
+
+# l'impronta viene calcolata lato client, l'id è il rowid implicito
+STATEMENTS.HASH_KEY = '''ALTER TABLE {0} ADD COLUMN {1}_hash BLOB;
+    CREATE UNIQUE INDEX {0}_hash ON {0} ({1}_hash)'''
+
+STATEMENTS.ADD_ID = ''
+
+# gli indici vengono creati uno alla volta, nello stesso script
+STATEMENTS.ADD_KEY = 'CREATE INDEX IF NOT EXISTS {} ON {table} ({})'
+
+STATEMENTS.ALTER_TABLE = '{1}'
+
+STATEMENTS.KEY_SEPARATOR = ';\n'
+
+STATEMENTS.NATURAL_KEY = 'CREATE UNIQUE INDEX IF NOT EXISTS {} ON {table} ({})'
+
+# le righe uguali a quelle presenti non vengono aggiornate né contate;
+# i conflitti sull'impronta restano ignorati da "OR IGNORE"
+STATEMENTS.UPSERT_TABLES = '''INSERT OR IGNORE INTO {0} ({1}) VALUES({2})
+    ON CONFLICT ({key}) DO UPDATE SET
+        data_inserimento = CURRENT_TIMESTAMP,
+        {4}
+    WHERE NOT ({3})'''
+
+STATEMENTS.UPSERT_SAME = '{0} IS excluded.{0}'
+
+STATEMENTS.UPSERT_COLUMN = '{0} = excluded.{0}'
+
+STATEMENTS.SET_PROGRESS = '''
+    INSERT INTO loaded_progress (table_name, file_name, line_offset, row_count)
+    VALUES(%s, %s, %s, %s)
+    ON CONFLICT (table_name, file_name) DO UPDATE SET
+        line_offset = excluded.line_offset,
+        row_count = excluded.row_count'''
+
+STATEMENTS.SET_PACKAGE = '''
+    INSERT INTO packages (package_name, metadata_modified) VALUES(%s, %s)
+    ON CONFLICT (package_name) DO UPDATE SET
+        metadata_modified = excluded.metadata_modified'''
+
+STATEMENTS.SET_RESOURCE = '''
+    INSERT INTO resources (resource_id, package_name, table_name, file_name,
+                           last_modified, metadata_modified, size)
+    VALUES(%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (resource_id) DO UPDATE SET
+        last_modified = excluded.last_modified,
+        metadata_modified = excluded.metadata_modified,
+        size = excluded.size'''
+
+# non supportati: LOAD DATA, partizioni e scambio delle tabelle
+STATEMENTS.LOAD_INFILE = None
+STATEMENTS.PARTITION_BY = None
+STATEMENTS.SWAP_TABLES = None
+
+# righe inserite da un upsert, riconosciute dal rowid
+LAST_ROWID = 'SELECT IFNULL(MAX(rowid), 0) AS last_rowid FROM {}'
+NEW_ROWS = 'SELECT COUNT(*) AS new_rows FROM {} WHERE rowid > %s'
+
+NAMED_KEY = re.compile(r'PRIMARY\s+KEY\s+\w+\s*\(', re.IGNORECASE)
+
+# righe di commento "#" e "-- " di MySQL, non riconosciute da SQLite
+COMMENT = re.compile(r'^[ \t]*(#|-- ).*\n?', re.MULTILINE)
+
+ERRORS = (('no such table', errorcode.ER_NO_SUCH_TABLE),
+          ('already exists', errorcode.ER_TABLE_EXISTS_ERROR),
+          ('UNIQUE constraint failed', errorcode.ER_DUP_ENTRY))
+
+
+def as_dict(cur, row):
+    return {column[0]: value for column, value in zip(cur.description, row)}
+
+
+@contextmanager
+def converted():
+    '''
+    Converte gli errori di SQLite in quelli del connettore MySQL.
+    '''
+    try:
+        yield
+
+    except sqlite3.Error as err:
+        for message, errno in ERRORS:
+            if message in str(err):
+                raise errors.ProgrammingError(str(err), errno=errno)
+
+        raise errors.DatabaseError(str(err)) from err
+
+
+def translate(stmt):
+    '''
+    Adatta un'istruzione MySQL a SQLite: segnaposto "?", INSERT OR IGNORE,
+    primary key senza nome e senza righe di commento.
+    '''
+    stmt = COMMENT.sub('', stmt)
+    stmt = stmt.replace('%s', '?').replace('INSERT IGNORE', 'INSERT OR IGNORE')
+
+    return NAMED_KEY.sub('PRIMARY KEY (', stmt)
+
+
+class TurnLock:
+    '''
+    Lock concesso ai thread nell'ordine delle richieste: un thread che lo
+    rilascia e lo richiede subito non lo riprende prima degli altri.
+    '''
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.next = self.serving = 0
+
+    def acquire(self):
+        with self.condition:
+            turn = self.next
+            self.next += 1
+
+            self.condition.wait_for(lambda: self.serving == turn)
+
+    def release(self):
+        with self.condition:
+            self.serving += 1
+            self.condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SQLiteDataBase:
+    '''
+    Database SQLite in un file locale, con la stessa interfaccia di
+    DataBase. Ogni thread usa una propria connessione; gli inserimenti
+    multipli avvengono in un'unica transazione, oppure in quella della
+    sessione aperta dal thread. SQLite ammette un solo scrittore alla
+    volta: le transazioni e le istruzioni fuori sessione dei vari thread
+    si alternano tramite "lock". Gli errori vengono convertiti in quelli
+    del connettore MySQL, gestiti da Operations.
+    '''
+    statements = STATEMENTS
+
+    inline_keys = False
+    client_hash = True
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = TurnLock()
+
+    def connect(self):
+        if (cnx := getattr(self.local, 'cnx', None)) is None:
+            cnx = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                  check_same_thread=False)
+
+            cnx.execute('PRAGMA journal_mode = WAL')
+            cnx.execute('PRAGMA synchronous = NORMAL')
+
+            self.local.cnx = cnx
+            self.local.session = False
+
+        return cnx
+
+    def begin(self, cnx):
+        '''
+        Attende il turno del thread ed apre una transazione che acquisisce
+        subito il lock in scrittura: una transazione che legge e poi scrive
+        fallirebbe se un altro thread scrivesse nel frattempo, senza
+        attendere il timeout.
+        '''
+        self.lock.acquire()
+
+        try:
+            with converted():
+                cnx.execute('BEGIN IMMEDIATE')
+
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def end(self, cnx, stmt):
+        '''
+        Conferma od annulla la transazione e cede il turno.
+        '''
+        try:
+            with converted():
+                try:
+                    cnx.execute(stmt)
+
+                finally:
+                    if cnx.in_transaction:
+                        cnx.execute('ROLLBACK')
+
+        finally:
+            self.lock.release()
+
+    @contextmanager
+    def session(self):
+        '''
+        Esegue le istruzioni del thread corrente in transazioni confermate
+        da "commit" ed al termine del blocco.
+        '''
+        cnx = self.connect()
+
+        if self.local.session:
+            yield
+            return
+
+        self.begin(cnx)
+        self.local.session = True
+
+        try:
+            yield
+
+        except BaseException:
+            # senza transazione se "commit" non ha potuto aprirne un'altra
+            if cnx.in_transaction:
+                self.end(cnx, 'ROLLBACK')
+
+            raise
+
+        else:
+            self.end(cnx, 'COMMIT')
+
+        finally:
+            self.local.session = False
+
+    def commit(self):
+        '''
+        Conferma la transazione della sessione del thread corrente e ne
+        apre una nuova, dopo aver ceduto il turno agli altri thread.
+        '''
+        cnx = self.connect()
+
+        if self.local.session:
+            self.end(cnx, 'COMMIT')
+            self.begin(cnx)
+
+    def execute(self, stmt, params=None, many=False, dictionary=True):
+        cnx = self.connect()
+        stmt = translate(stmt)
+
+        cur = cnx.cursor()
+        if dictionary:
+            cur.row_factory = as_dict
+
+        if self.local.session:
+            with converted():
+                self.run(cur, stmt, params, many)
+
+            return cur
+
+        with self.lock, converted():
+            if many:
+                cnx.execute('BEGIN')
+
+                try:
+                    cur.executemany(stmt, params)
+                    cnx.execute('COMMIT')
+                except BaseException:
+                    cnx.execute('ROLLBACK')
+                    raise
+
+            else:
+                self.run(cur, stmt, params, many)
+
+        return cur
+
+    @staticmethod
+    def run(cur, stmt, params=None, many=False):
+        if many:
+            cur.executemany(stmt, params)
+
+        elif params is None and ';' in stmt:
+            cur.executescript(stmt)
+
+        else:
+            cur.execute(stmt, params or ())
+
+    def upsert(self, table, stmt, params):
+        '''
+        Esegue un upsert multiplo e ritorna le righe inserite e quelle
+        aggiornate. Le righe inserite ricevono un rowid successivo a quelli
+        presenti; ogni riga inserita od aggiornata vale una riga nel
+        conteggio.
+        '''
+        last = self.execute(LAST_ROWID.format(table)).fetchone()['last_rowid']
+        rows = self.execute(stmt, params, many=True).rowcount
+
+        inserted = self.execute(
+            NEW_ROWS.format(table), (last,)).fetchone()['new_rows']
+
+        return inserted, rows - inserted
+
+    def stream(self, stmt, params=None, size=10_000):
+        cur = self.execute(stmt, params, dictionary=False)
+
+        while (rows := cur.fetchmany(size)):
+            yield from rows
@@ -11,7 +11,82 @@ DB_CREDENTIALS = {'host': 'xxx.xxx.xxx.xxx',
 
 # DEFAULT_DOWNLOAD_PATH = 'anac_json/'
 
+# directory dei file zip scaricati dal portale
+CACHE_PATH = 'anac_cache/'
+
+# numero di file scaricati in anticipo e dimensione massima in byte
+PREFETCH_DEPTH = 2
+PREFETCH_BYTES = 4 * 1024 ** 3
+
+# righe per pacchetto iniziali, minime e massime; il numero si adatta
+# per avvicinare la durata di ogni insert a BATCH_SECONDS
 BATCH_SIZE = 75_000
+BATCH_MIN = 1_000
+BATCH_MAX = 250_000
+BATCH_SECONDS = 2.0
+
+# byte massimi per pacchetto, comunque non oltre metà di max_allowed_packet
+BATCH_BYTES = 64 * 1024 ** 2
+
+# righe json decodificate con una sola chiamata
+DECODE_BLOCK = 1_000
+
+# byte letti per ogni blocco inviato ai processi con l'opzione --parsers
+PARSE_BYTES = 1024 ** 2
+
+# packages richiesti per ogni chiamata a package_search
+SEARCH_ROWS = 1_000
+
+# file del catalogo dei packages e richieste parallele al portale
+CATALOG_PATH = 'anac_catalog.json'
+CATALOG_WORKERS = 8
+
+# secondi fra due campioni del profilatore a campionamento
+PROFILE_INTERVAL = 0.01
+
+# tabelle partizionate per anno con l'opzione --partition: espressione
+# dell'anno ed anno della prima partizione, le righe precedenti (o senza
+# anno) finiscono nella partizione "p0"
+PARTITIONS = {
+    'cig': 'anno_pubblicazione',
+    'smartcig': 'anno_comunicazione',
+    'aggiudicazioni': 'YEAR(data_comunicazione_esito)',
+}
+PARTITION_FIRST = 2007
+
+# watermark iniziale della tabella "sintesi": tutte le righe sono nuove
+SINTESI_START = '1000-01-01 00:00:00'
+
+# secondi riletti prima del watermark: "data_inserimento" viene assegnata
+# all'inserimento, ma le righe diventano visibili solo quando la transazione
+# che le contiene (fino a COMMIT_BATCHES pacchetti) viene confermata
+SINTESI_MARGIN = 3600
+
+# copia Parquet delle risorse caricate con l'opzione --mirror e righe
+# scritte per ogni row group
+MIRROR_PATH = 'anac_mirror/'
+MIRROR_ROWS = 100_000
+
+# lettura dei file zip durante il download con l'opzione --stream: byte
+# letti per ogni blocco, tentativi di ripresa e timeout in secondi
+STREAM_CHUNK = 64 * 1024
+STREAM_RETRIES = 5
+STREAM_TIMEOUT = 60
+
+# connessioni nel pool, aumentate se necessario con l'opzione --jobs
+POOL_SIZE = 5
+
+# pacchetti inseriti in ogni transazione durante il caricamento di un file
+COMMIT_BATCHES = 8
+
+# impostazioni della sessione usata per caricare un file, applicate solo se
+# permesse dal server e poi ripristinate; "unique_checks" resta attivo
+# perché l'eliminazione dei duplicati si basa sulla chiave "<table>_hash"
+SESSION_SETTINGS = {'foreign_key_checks': 0}
+
+GET_SESSION_VARIABLE = 'SELECT @@SESSION.{} AS value'
+
+SET_SESSION_VARIABLE = 'SET SESSION {} = %s'
 
 
 # nome della tabella e del file path associato
@@ -33,6 +108,18 @@ GET_TABLE_COLUMNS = '''
         EXTRA = ""
     '''
 
+GET_COLUMN_TYPES = '''
+    SELECT
+        COLUMN_NAME,
+        DATA_TYPE
+    FROM
+        INFORMATION_SCHEMA.COLUMNS
+    WHERE
+        TABLE_SCHEMA = DATABASE() AND
+        TABLE_NAME = %s AND
+        EXTRA = ""
+    '''
+
 GET_ALL_COLUMNS = '''
     SELECT
         TABLE_NAME,
@@ -44,13 +131,99 @@ GET_ALL_COLUMNS = '''
         EXTRA = ""
     '''
 
+GET_MAX_PACKET = 'SELECT @@max_allowed_packet AS max_allowed_packet'
+
 INSERT_TABLES = 'INSERT IGNORE INTO {} ({}) VALUES({})'
 
+# chiavi naturali delle tabelle caricate con l'opzione --upsert: le righe
+# con la stessa chiave di una riga presente la aggiornano; "data_inserimento"
+# cambia solo se cambia almeno un valore
+NATURAL_KEYS = {
+    'cig': ('cig',),
+    'aggiudicazioni': ('id_aggiudicazione',),
+}
+
+NATURAL_KEY = 'ADD UNIQUE KEY {} ({})'
+
+# ogni riga aggiornata vale UPSERT_ROWCOUNT righe nel conteggio del database
+UPSERT_TABLES = '''INSERT IGNORE INTO {0} ({1}) VALUES({2})
+    ON DUPLICATE KEY UPDATE
+        data_inserimento = IF({3}, data_inserimento, CURRENT_TIMESTAMP),
+        {4}'''
+
+UPSERT_SAME = '{0} <=> VALUES({0})'
+
+UPSERT_COLUMN = '{0} = VALUES({0})'
+
+UPSERT_ROWCOUNT = 2
+
+# formato di default: campi separati da tab, righe da "\n", NULL come "\N"
+LOAD_INFILE = '''LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE {}
+                CHARACTER SET utf8mb4 ({})'''
+
 HASH_KEY = '''ALTER TABLE {} ADD COLUMN {}_hash BINARY(20) AS
                 (UNHEX(SHA(CONCAT_WS(";",{})))) STORED INVISIBLE UNIQUE'''
 
+GET_INDEXES = '''
+    SELECT DISTINCT
+        INDEX_NAME
+    FROM
+        INFORMATION_SCHEMA.STATISTICS
+    WHERE
+        TABLE_SCHEMA = DATABASE() AND
+        TABLE_NAME = %s
+    '''
+
+ALTER_TABLE = 'ALTER TABLE {} {}'
+
+# suffisso della tabella ombra caricata con l'opzione --swap
+SHADOW_SUFFIX = '__new'
+
+CREATE_LIKE = 'CREATE TABLE IF NOT EXISTS {} LIKE {}'
+
+SWAP_TABLES = 'RENAME TABLE {0} TO {0}__old, {1} TO {0}'
+
+DROP_TABLE = 'DROP TABLE IF EXISTS {}__old'
+
+ADD_KEY = 'ADD KEY {} ({})'
+
+KEY_SEPARATOR = ','
+
+GET_HASHES = 'SELECT {}_hash FROM {} ORDER BY {}_hash'
+
 ADD_ID = 'ALTER TABLE {} ADD COLUMN {}_id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY'
 
+# nelle tabelle partizionate ogni chiave unique deve includere la colonna
+# "<table>_anno" usata per il partizionamento; NULL diventa l'anno 0
+PARTITION_KEYS = '''ALTER TABLE {0}
+    ADD COLUMN {1}_anno SMALLINT AS (IFNULL({2}, 0)) STORED NOT NULL INVISIBLE,
+    ADD COLUMN {1}_hash BINARY(20) AS
+        (UNHEX(SHA(CONCAT_WS(";",{3})))) STORED INVISIBLE,
+    ADD COLUMN {1}_id BIGINT UNSIGNED AUTO_INCREMENT,
+    ADD PRIMARY KEY ({1}_id, {1}_anno),
+    ADD UNIQUE KEY {1}_hash ({1}_hash, {1}_anno)'''
+
+PARTITION_BY = 'ALTER TABLE {} PARTITION BY RANGE ({}_anno) ({})'
+
+REORGANIZE_PARTITION = 'ALTER TABLE {} REORGANIZE PARTITION pmax INTO ({})'
+
+PARTITION = 'PARTITION p{} VALUES LESS THAN ({})'
+
+LAST_PARTITION = 'PARTITION pmax VALUES LESS THAN MAXVALUE'
+
+TRUNCATE_PARTITION = 'ALTER TABLE {} TRUNCATE PARTITION {}'
+
+GET_PARTITIONS = '''
+    SELECT
+        PARTITION_NAME
+    FROM
+        INFORMATION_SCHEMA.PARTITIONS
+    WHERE
+        TABLE_SCHEMA = DATABASE() AND
+        TABLE_NAME = %s AND
+        PARTITION_NAME IS NOT NULL
+    '''
+
 CREATE_LOADED = '''
     CREATE TABLE loaded (
         table_name VARCHAR(64) NOT NULL,
@@ -60,10 +233,219 @@ CREATE_LOADED = '''
         )'''
 
 
-GET_LOADED = 'SELECT file_name FROM loaded'
+GET_LOADED = 'SELECT table_name, file_name FROM loaded'
+
+GET_TABLE_LOADED = 'SELECT file_name FROM loaded WHERE table_name = %s'
+
+DELETE_LOADED = 'DELETE FROM loaded WHERE table_name = %s AND file_name = %s'
+
+CLEAR_LOADED = 'DELETE FROM loaded WHERE table_name = %s'
+
+MOVE_LOADED = 'UPDATE loaded SET table_name = %s WHERE table_name = %s'
 
 INSERT_LOADED = 'INSERT IGNORE INTO loaded (table_name, file_name) VALUES(%s, %s)'
 
+CREATE_PROGRESS = '''
+    CREATE TABLE IF NOT EXISTS loaded_progress (
+        table_name VARCHAR(64) NOT NULL,
+        file_name VARCHAR(128) NOT NULL,
+        line_offset BIGINT UNSIGNED NOT NULL,
+        row_count BIGINT UNSIGNED NOT NULL,
+        data_inserimento DATETIME DEFAULT (CURRENT_TIMESTAMP),
+        PRIMARY KEY id_progress_file (table_name, file_name)
+        )'''
+
+GET_PROGRESS = '''
+    SELECT
+        line_offset,
+        row_count
+    FROM
+        loaded_progress
+    WHERE
+        table_name = %s AND
+        file_name = %s
+    '''
+
+SET_PROGRESS = '''
+    INSERT INTO loaded_progress (table_name, file_name, line_offset, row_count)
+    VALUES(%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        line_offset = VALUES(line_offset),
+        row_count = VALUES(row_count)'''
+
+DELETE_PROGRESS = 'DELETE FROM loaded_progress WHERE table_name = %s AND file_name = %s'
+
+CREATE_PACKAGES = '''
+    CREATE TABLE IF NOT EXISTS packages (
+        package_name VARCHAR(128) NOT NULL,
+        metadata_modified VARCHAR(32) DEFAULT NULL,
+        data_inserimento DATETIME DEFAULT (CURRENT_TIMESTAMP),
+        PRIMARY KEY id_package (package_name)
+        )'''
+
+CREATE_RESOURCES = '''
+    CREATE TABLE IF NOT EXISTS resources (
+        resource_id VARCHAR(64) NOT NULL,
+        package_name VARCHAR(128) NOT NULL,
+        table_name VARCHAR(64) NOT NULL,
+        file_name VARCHAR(128) NOT NULL,
+        last_modified VARCHAR(32) DEFAULT NULL,
+        metadata_modified VARCHAR(32) DEFAULT NULL,
+        size BIGINT UNSIGNED DEFAULT NULL,
+        data_inserimento DATETIME DEFAULT (CURRENT_TIMESTAMP),
+        PRIMARY KEY id_resource (resource_id)
+        )'''
+
+GET_PACKAGES = 'SELECT package_name, metadata_modified FROM packages'
+
+GET_RESOURCES = 'SELECT resource_id, last_modified, metadata_modified, size FROM resources'
+
+SET_PACKAGE = '''
+    INSERT INTO packages (package_name, metadata_modified) VALUES(%s, %s)
+    ON DUPLICATE KEY UPDATE
+        metadata_modified = VALUES(metadata_modified)'''
+
+SET_RESOURCE = '''
+    INSERT INTO resources (resource_id, package_name, table_name, file_name,
+                           last_modified, metadata_modified, size)
+    VALUES(%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        last_modified = VALUES(last_modified),
+        metadata_modified = VALUES(metadata_modified),
+        size = VALUES(size)'''
+
+CREATE_SUMMARY_MARKS = '''
+    CREATE TABLE IF NOT EXISTS summary_marks (
+        summary_name VARCHAR(64) NOT NULL,
+        watermark DATETIME NOT NULL,
+        data_inserimento DATETIME DEFAULT (CURRENT_TIMESTAMP),
+        PRIMARY KEY id_summary (summary_name)
+        )'''
+
+GET_SUMMARY_MARK = 'SELECT watermark FROM summary_marks WHERE summary_name = %s'
+
+SET_SUMMARY_MARK = '''
+    INSERT INTO summary_marks (summary_name, watermark) VALUES(%s, %s)
+    ON DUPLICATE KEY UPDATE
+        watermark = VALUES(watermark)'''
+
+GET_NOW = 'SELECT NOW() AS now'
+
+CREATE_SINTESI = '''
+    CREATE TABLE IF NOT EXISTS sintesi (
+        cig VARCHAR(64) DEFAULT NULL,
+        numero_gara BIGINT DEFAULT NULL,
+        oggetto_gara TEXT DEFAULT NULL,
+        oggetto_lotto TEXT DEFAULT NULL,
+        importo_lotto DOUBLE DEFAULT NULL,
+        oggetto_principale_contratto VARCHAR(64) DEFAULT NULL,
+        tipo_scelta_contraente VARCHAR(384) DEFAULT NULL,
+        data_pubblicazione DATETIME DEFAULT NULL,
+        anno_pubblicazione SMALLINT DEFAULT NULL,
+        cf_amministrazione_appaltante VARCHAR(64) DEFAULT NULL,
+        denominazione_amministrazione_appaltante VARCHAR(384) DEFAULT NULL,
+        provincia VARCHAR(64) DEFAULT NULL,
+        sigla_provincia VARCHAR(64) DEFAULT NULL,
+        regione VARCHAR(64) DEFAULT NULL,
+        cod_cpv VARCHAR(64) DEFAULT NULL,
+        descrizione_cpv VARCHAR(384) DEFAULT NULL,
+        id_aggiudicazione BIGINT UNSIGNED DEFAULT NULL,
+        data_aggiudicazione_definitiva DATETIME DEFAULT NULL,
+        esito VARCHAR(384) DEFAULT NULL,
+        importo_aggiudicazione DOUBLE DEFAULT NULL,
+        ribasso_aggiudicazione DOUBLE DEFAULT NULL,
+        numero_offerte_ammesse INT DEFAULT NULL,
+        ruolo VARCHAR(64) DEFAULT NULL,
+        cf_aggiudicatario VARCHAR(64) DEFAULT NULL,
+        denominazione_aggiudicatario VARCHAR(384) DEFAULT NULL,
+        tipo_soggetto VARCHAR(384) DEFAULT NULL,
+        data_inserimento DATETIME DEFAULT (CURRENT_TIMESTAMP),
+        KEY idx_sintesi_cig (cig),
+        KEY idx_sintesi_anno (anno_pubblicazione),
+        KEY idx_sintesi_cod_cpv (cod_cpv),
+        KEY idx_sintesi_regione (regione),
+        KEY idx_sintesi_cf_amministrazione (cf_amministrazione_appaltante),
+        KEY idx_sintesi_cf_aggiudicatario (cf_aggiudicatario)
+        )'''
+
+# ad ogni aggiornamento vengono rimossi e ricalcolati i cig presenti
+# in "sintesi_delta"
+CREATE_SINTESI_DELTA = '''
+    CREATE TEMPORARY TABLE sintesi_delta (
+        cig VARCHAR(64) NOT NULL,
+        PRIMARY KEY id_sintesi_delta (cig)
+        )'''
+
+DROP_SINTESI_DELTA = 'DROP TEMPORARY TABLE IF EXISTS sintesi_delta'
+
+# tabella ricostruita da zero con l'opzione --full e poi scambiata
+DROP_SINTESI_SHADOW = f'DROP TABLE IF EXISTS sintesi{SHADOW_SUFFIX}'
+
+# cig con righe inserite in "cig", "aggiudicazioni" o "aggiudicatari"
+# nell'intervallo [watermark precedente, inizio dell'aggiornamento)
+SET_SINTESI_DELTA = '''
+    INSERT IGNORE INTO sintesi_delta (cig)
+    SELECT cig FROM cig
+    WHERE data_inserimento >= %(start)s AND data_inserimento < %(end)s
+        AND cig IS NOT NULL
+    UNION
+    SELECT cig FROM aggiudicazioni
+    WHERE data_inserimento >= %(start)s AND data_inserimento < %(end)s
+        AND cig IS NOT NULL
+    UNION
+    SELECT cig FROM aggiudicatari
+    WHERE data_inserimento >= %(start)s AND data_inserimento < %(end)s
+        AND cig IS NOT NULL
+    '''
+
+DELETE_SINTESI = '''
+    DELETE s FROM {} s
+    JOIN sintesi_delta d ON d.cig = s.cig
+    '''
+
+INSERT_SINTESI = '''
+    INSERT INTO {} (
+        cig, numero_gara, oggetto_gara, oggetto_lotto, importo_lotto,
+        oggetto_principale_contratto, tipo_scelta_contraente,
+        data_pubblicazione, anno_pubblicazione, cf_amministrazione_appaltante,
+        denominazione_amministrazione_appaltante, provincia, sigla_provincia,
+        regione, cod_cpv, descrizione_cpv, id_aggiudicazione,
+        data_aggiudicazione_definitiva, esito, importo_aggiudicazione,
+        ribasso_aggiudicazione, numero_offerte_ammesse, ruolo,
+        cf_aggiudicatario, denominazione_aggiudicatario, tipo_soggetto)
+    SELECT
+        c.cig, c.numero_gara, c.oggetto_gara, c.oggetto_lotto, c.importo_lotto,
+        c.oggetto_principale_contratto, c.tipo_scelta_contraente,
+        c.data_pubblicazione, c.anno_pubblicazione, c.cf_amministrazione_appaltante,
+        c.denominazione_amministrazione_appaltante, c.provincia, p.Sigla,
+        p.regione, c.cod_cpv, c.descrizione_cpv, a.id_aggiudicazione,
+        a.data_aggiudicazione_definitiva, a.esito, a.importo_aggiudicazione,
+        a.ribasso_aggiudicazione, a.numero_offerte_ammesse, g.ruolo,
+        g.codice_fiscale, g.denominazione, g.tipo_soggetto
+    FROM
+        sintesi_delta d
+        JOIN cig c ON c.cig = d.cig
+        LEFT JOIN province p ON p.provincia = c.provincia
+        LEFT JOIN aggiudicazioni a ON a.cig = c.cig
+        LEFT JOIN aggiudicatari g ON g.id_aggiudicazione = a.id_aggiudicazione
+    '''
+
+CREATE_SINTESI_CPV = '''
+    CREATE OR REPLACE VIEW sintesi_cpv AS
+    SELECT
+        s.*,
+        v.IT_descrizione_divisione,
+        v.IT_descrizione_gruppo,
+        v.IT_descrizione_classe,
+        v.IT_descrizione_categorie,
+        v.IT_descrizione_sub_categorie,
+        v.IT_descrizione_sub_sub_categorie,
+        v.IT_descrizione_sub_sub_sub_categorie
+    FROM
+        sintesi s
+        LEFT JOIN cpv v ON v.cod_cpv_ = s.cod_cpv
+    '''
+
 CREATE_USER_TABLES = {
     'cpv': '''
     CREATE TABLE cpv (
@@ -0,0 +1,274 @@
+import io
+import logging
+import struct
+import time
+import zlib
+from collections import Counter
+from http.client import HTTPException, IncompleteRead
+from urllib.request import Request, urlopen
+from zipfile import BadZipFile
+
+from anac import statements as stmts
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+EXTRA_HEADER = struct.Struct('<HH')
+LOCAL_SIGNATURE = b'PK\x03\x04'
+DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+ZIP64_EXTRA = 0x0001
+
+ENCRYPTED = 0x01
+DATA_DESCRIPTOR = 0x08
+UTF8_NAME = 0x800
+
+STORED, DEFLATED = 0, 8
+
+
+class HTTPStream:
+    '''
+    Corpo di una risposta HTTP letto a blocchi. Se la connessione si
+    interrompe la richiesta viene ripetuta con l'header Range a partire
+    dal primo byte non ricevuto, purché la risorsa non sia cambiata; senza
+    ETag o Last-Modified non è possibile verificarlo ed il download non
+    viene ripreso.
+    '''
+    def __init__(self, url, retries=stmts.STREAM_RETRIES, stats=None):
+        self.url = url
+        self.retries = retries
+        self.stats = Counter() if stats is None else stats
+        self.offset = 0
+        self.length = None
+        self.validator = None
+        self.response = None
+
+    def open(self):
+        headers = {}
+        if self.offset:
+            headers['Range'] = f'bytes={self.offset}-'
+
+            if self.validator:
+                headers['If-Range'] = self.validator
+
+        response = urlopen(Request(self.url, headers=headers),
+                           timeout=stmts.STREAM_TIMEOUT)
+
+        if self.offset and response.status != 206:
+            response.close()
+            raise ValueError(f'"{self.url}" changed or cannot be resumed')
+
+        if not self.offset:
+            self.validator = (response.headers.get('ETag') or
+                              response.headers.get('Last-Modified'))
+
+        if (length := response.headers.get('Content-Length')) is not None:
+            self.length = self.offset + int(length)
+
+        self.response = response
+
+    def read(self, size):
+        for attempt in range(self.retries + 1):
+            try:
+                if self.response is None:
+                    self.open()
+
+                start = time.perf_counter()
+                data = self.response.read(size)
+                self.stats['download_seconds'] += time.perf_counter() - start
+
+                if not data and self.length and self.offset < self.length:
+                    raise IncompleteRead(b'', self.length - self.offset)
+
+                self.stats['download_bytes'] += len(data)
+                self.offset += len(data)
+
+                return data
+
+            except (OSError, HTTPException) as err:
+                self.close()
+
+                if attempt == self.retries:
+                    raise
+
+                if self.offset and not self.validator:
+                    raise ValueError(f'"{self.url}" cannot be resumed safely:'
+                                     ' no ETag or Last-Modified') from err
+
+                logging.warning('"%s" interrupted at byte %s: %r, resuming',
+                                self.url, self.offset, err)
+
+                time.sleep(min(2 ** attempt, 30))
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+
+
+class ZipMember(io.RawIOBase):
+    '''
+    Decomprime un file contenuto in un archivio zip mentre l'archivio
+    viene scaricato, leggendo gli header locali senza attendere la
+    directory centrale alla fine del file. La memoria usata dipende
+    solo dalla dimensione dei blocchi letti.
+    '''
+    def __init__(self, source, name):
+        self.source = source
+        self.name = name
+        self.pending = b''
+        self.crc = 0
+        self.done = False
+
+        self.find()
+
+    def readable(self):
+        return True
+
+    def read_source(self, size):
+        if self.pending:
+            data, self.pending = self.pending[:size], self.pending[size:]
+            return data
+
+        return self.source.read(size)
+
+    def read_exact(self, size):
+        data = b''
+        while len(data) < size:
+            if not (chunk := self.read_source(size - len(data))):
+                raise BadZipFile(f'"{self.name}": truncated archive')
+
+            data += chunk
+
+        return data
+
+    def inflate(self, inflater, size):
+        '''
+        Ritorna fino a "size" byte decompressi, oppure b'' alla fine dei
+        dati compressi del file.
+        '''
+        while not inflater.eof:
+            if inflater.unconsumed_tail:
+                chunk = inflater.unconsumed_tail
+            elif not (chunk := self.read_source(stmts.STREAM_CHUNK)):
+                raise BadZipFile(f'"{self.name}": truncated archive')
+
+            if (data := inflater.decompress(chunk, size)):
+                return data
+
+        self.pending = inflater.unused_data + self.pending
+
+        return b''
+
+    def read_descriptor(self, zip64=False):
+        '''
+        Legge il data descriptor che segue i dati compressi e ne ritorna
+        il CRC-32; la firma iniziale è facoltativa.
+        '''
+        if (crc := self.read_exact(4)) == DESCRIPTOR_SIGNATURE:
+            crc = self.read_exact(4)
+
+        self.read_exact(16 if zip64 else 8)
+
+        return struct.unpack('<I', crc)[0]
+
+    @staticmethod
+    def is_zip64(extra):
+        while len(extra) >= EXTRA_HEADER.size:
+            kind, size = EXTRA_HEADER.unpack_from(extra)
+
+            if kind == ZIP64_EXTRA:
+                return True
+
+            extra = extra[EXTRA_HEADER.size + size:]
+
+        return False
+
+    def find(self):
+        '''
+        Scorre gli header locali fino al file cercato, saltando gli altri.
+        '''
+        while True:
+            header = self.read_exact(LOCAL_HEADER.size)
+            (signature, _, flags, method, _, _, crc, compressed, _,
+             name_size, extra_size) = LOCAL_HEADER.unpack(header)
+
+            if signature != LOCAL_SIGNATURE:
+                raise KeyError(f'"{self.name}" not in archive')
+
+            name = self.read_exact(name_size)
+            name = name.decode('utf-8' if flags & UTF8_NAME else 'cp437')
+            zip64 = self.is_zip64(self.read_exact(extra_size))
+
+            if flags & ENCRYPTED:
+                raise BadZipFile(f'"{name}": encrypted files not supported')
+
+            descriptor = flags & DATA_DESCRIPTOR
+
+            if name == self.name and method in (STORED, DEFLATED):
+                if method == STORED and descriptor:
+                    raise BadZipFile(f'"{name}": unknown size')
+
+                self.method = method
+                self.remaining = compressed
+                self.descriptor = zip64 if descriptor else None
+                self.expected_crc = crc
+                self.inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+
+                return
+
+            if not descriptor:
+                self.read_exact(compressed)
+            elif method == DEFLATED:
+                skipper = zlib.decompressobj(-zlib.MAX_WBITS)
+
+                while self.inflate(skipper, stmts.STREAM_CHUNK):
+                    pass
+
+                self.read_descriptor(zip64)
+            else:
+                raise BadZipFile(f'"{name}": unknown size')
+
+    def readinto(self, buffer):
+        if self.done or not len(buffer):
+            return 0
+
+        if self.method == STORED:
+            data = self.read_source(min(len(buffer), self.remaining))
+            self.remaining -= len(data)
+
+            if not data and self.remaining:
+                raise BadZipFile(f'"{self.name}": truncated archive')
+        else:
+            data = self.inflate(self.inflater, len(buffer))
+
+        self.crc = zlib.crc32(data, self.crc)
+
+        if not data or (self.method == STORED and not self.remaining):
+            self.finish()
+
+        buffer[:len(data)] = data
+
+        return len(data)
+
+    def finish(self):
+        self.done = True
+
+        if self.descriptor is not None:
+            self.expected_crc = self.read_descriptor(self.descriptor)
+
+        self.source.close()
+
+        if self.crc != self.expected_crc:
+            raise BadZipFile(f'"{self.name}": bad CRC-32')
+
+    def close(self):
+        self.source.close()
+        super().close()
+
+
+def open_member(url, name, stats=None):
+    '''
+    Ritorna il file "name" dell'archivio zip all'indirizzo "url", letto
+    e decompresso durante il download, come un file binario.
+    '''
+    source = HTTPStream(url, stats=stats)
+
+    return io.BufferedReader(ZipMember(source, name), stmts.STREAM_CHUNK)
@@ -0,0 +1,294 @@
+import argparse
+import json
+import logging
+import os
+import random
+import string
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from anac import statements as stmts
+from anac.batches import BatchSizer, get_batches
+from anac.catalog import index
+from anac.ddl import parse_columns
+from anac.dedup import INTEGER_TYPES
+from anac.load import DataBase, Operations
+from anac.sqlite import SQLiteDataBase
+
+SCHEMA = stmts.CREATE_TABLES | stmts.CREATE_USER_TABLES
+
+# colonne avvalorate dal database
+DEFAULT_COLUMNS = ('data_inserimento',)
+
+INTEGER_RANGES = {'tinyint': 255, 'smallint': 32_767, 'mediumint': 8_388_607}
+
+
+def data_columns(table):
+    '''
+    Ritorna le colonne della tabella che vengono lette dai file.
+    '''
+    return [column for column in parse_columns(SCHEMA[table])
+            if column[0] not in DEFAULT_COLUMNS]
+
+
+def random_value(rng, kind, size, width):
+    '''
+    Genera un valore casuale compatibile con il tipo della colonna.
+    '''
+    if kind in INTEGER_TYPES:
+        return rng.randint(0, INTEGER_RANGES.get(kind, 2_000_000_000))
+
+    if kind in ('double', 'float'):
+        return round(rng.uniform(0, 1_000_000), 2)
+
+    if kind == 'datetime':
+        return datetime(rng.randint(2010, 2024), rng.randint(1, 12),
+                        rng.randint(1, 28)).isoformat()
+
+    if kind == 'json':
+        return [random_value(rng, 'varchar', 64, width) for _ in range(2)]
+
+    length = rng.randint(1, min(size or 4 * width, width))
+
+    return ''.join(rng.choices(string.ascii_letters + ' ', k=length))
+
+
+def generate(table, path, rows, width=64, nulls=0.1, duplicates=0.0,
+             drift=0, seed=0):
+    '''
+    Crea un file zip con un file json per riga, come quelli del portale,
+    con colonne compatibili con lo schema della tabella. Una frazione
+    "nulls" dei valori è vuota, una frazione "duplicates" delle righe
+    ripete una riga precedente e "drift" chiavi non previste dallo schema
+    vengono aggiunte, oltre a chiavi scritte con "-" o con un suffisso.
+    '''
+    rng = random.Random(seed)
+    columns = data_columns(table)
+
+    keys = []
+    for i, (name, _, _) in enumerate(columns):
+        if drift and i % 3 == 1:
+            name = name.replace('_', '-')
+        elif drift and i % 3 == 2:
+            name = f'{name}_v2'
+
+        keys.append(name)
+
+    extra = [f'nuova_colonna_{i}' for i in range(drift)]
+
+    name = f'{table}_bench_{rows}.json'
+    generated = []
+
+    with (ZipFile(path, 'w', ZIP_DEFLATED) as zfile,
+            zfile.open(name, 'w') as file):
+
+        for _ in range(rows):
+            if generated and rng.random() < duplicates:
+                row = rng.choice(generated)
+
+            else:
+                row = {key: '' if rng.random() < nulls else
+                       random_value(rng, kind, size, width)
+                       for key, (_, kind, size) in zip(keys, columns)}
+                row.update((key, 'x') for key in extra)
+
+                if len(generated) < 10_000:
+                    generated.append(row)
+
+            file.write(json.dumps(row).encode() + b'\n')
+
+    return name
+
+
+class Cursor:
+    def __init__(self, rows=(), rowcount=0):
+        self.rows = list(rows)
+        self.rowcount = rowcount
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class MemoryDataBase:
+    '''
+    Sostituto in memoria di DataBase: risponde alle query di servizio di
+    Operations e simula INSERT IGNORE scartando le righe duplicate.
+    '''
+    statements = stmts
+
+    inline_keys = True
+    client_hash = False
+
+    def __init__(self):
+        self.tables = {}
+
+    def execute(self, stmt, params=None, many=False):
+        if stmt == stmts.GET_MAX_PACKET:
+            return Cursor([{'max_allowed_packet': 1024 ** 3}])
+
+        if stmt in (stmts.GET_TABLE_COLUMNS, stmts.GET_COLUMN_TYPES):
+            return Cursor({'COLUMN_NAME': name, 'DATA_TYPE': kind}
+                          for name, kind, _ in data_columns(params[0]))
+
+        if many:
+            rows = self.tables.setdefault(stmt.split()[3], set())
+            before = len(rows)
+            rows.update(params)
+
+            return Cursor(rowcount=len(rows) - before)
+
+        return Cursor()
+
+    def stream(self, stmt, params=None, size=None):
+        return iter(())
+
+    def session(self):
+        return nullcontext()
+
+    def commit(self):
+        pass
+
+
+def timed(results, table, stage, func, rows=None):
+    '''
+    Esegue "func" registrandone la durata fra i risultati.
+    '''
+    start = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - start
+
+    rows = len(value) if rows is None else rows
+
+    results.append({'table': table,
+                    'stage': stage,
+                    'rows': rows,
+                    'seconds': round(seconds, 6),
+                    'rows_per_second': round(rows / seconds) if seconds else None})
+
+    logging.info('%s %s: %s rows in %.3f s', table, stage, rows, seconds)
+
+    return value
+
+
+def run(ops, table, path, name, results):
+    '''
+    Misura separatamente le fasi del caricamento di un file.
+    '''
+    packages = [f'{tab.replace("_", "-")}-{i}' for tab in SCHEMA
+                for i in range(100)]
+    timed(results, table, 'index', lambda: list(index(packages)))
+
+    ops.create(SCHEMA, table, hash=True)
+
+    with ZipFile(path) as zfile, zfile.open(name) as file:
+        rows = timed(results, table, 'get_rows',
+                     lambda: list(ops.get_rows(file, ops.columns)))
+
+    timed(results, table, 'get_batches',
+          lambda: list(get_batches(iter(rows), BatchSizer(ops.max_bytes))),
+          rows=len(rows))
+
+    inserted = timed(results, table, 'load',
+                     lambda: ops.load(iter(rows), table, name), rows=len(rows))
+
+    results.append({'table': table, 'stage': 'inserted', 'rows': inserted})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='bench', description='generates synthetic ANAC files and\
+            measures each stage of the loader')
+
+    parser.add_argument(
+        '-t', '--tables', nargs='+', type=str, metavar='NAME',
+        default=['cig', 'cup'], help='tables to benchmark')
+
+    parser.add_argument(
+        '-n', '--rows', type=int, default=100_000,
+        help='rows for each synthetic file')
+
+    parser.add_argument(
+        '--width', type=int, default=64,
+        help='maximum length of the generated strings')
+
+    parser.add_argument(
+        '--nulls', type=float, default=0.1,
+        help='fraction of empty values')
+
+    parser.add_argument(
+        '--duplicates', type=float, default=0.0,
+        help='fraction of rows repeating a previous row')
+
+    parser.add_argument(
+        '--drift', type=int, default=0,
+        help='keys not in the schema added to every row')
+
+    parser.add_argument(
+        '--seed', type=int, default=0)
+
+    parser.add_argument(
+        '--data', type=str, metavar='PATH', default='bench_data/',
+        help='directory for the synthetic files')
+
+    parser.add_argument(
+        '--mysql', type=str, metavar='DATABASE',
+        help='run the inserts against this MySQL/MariaDB database, using\
+            the credentials in statements.py; its tables are dropped.\
+            Without it an in-memory stand-in is used')
+
+    parser.add_argument(
+        '--sqlite', type=str, metavar='PATH',
+        help='run the inserts against this SQLite database file; its tables\
+            are dropped')
+
+    parser.add_argument(
+        '-o', '--output', type=str, metavar='PATH',
+        default='bench_results.json', help='file for the results')
+
+    args = parser.parse_args()
+
+    for tab in args.tables:
+        if tab not in SCHEMA:
+            raise ValueError(f'table "{tab}" not in database schema')
+
+    if args.mysql:
+        database = DataBase(**(stmts.DB_CREDENTIALS | {'database': args.mysql}))
+
+        for tab in args.tables:
+            database.execute(f'DROP TABLE IF EXISTS {tab}')
+    elif args.sqlite:
+        database = SQLiteDataBase(args.sqlite)
+
+        for tab in args.tables:
+            database.execute(f'DROP TABLE IF EXISTS {tab}')
+    else:
+        database = MemoryDataBase()
+
+    ops = Operations(database=database)
+
+    os.makedirs(args.data, exist_ok=True)
+
+    results = []
+    for tab in args.tables:
+        path = os.path.join(args.data, f'{tab}_{args.rows}_{args.seed}.zip')
+
+        name = generate(tab, path, args.rows, args.width, args.nulls,
+                        args.duplicates, args.drift, args.seed)
+
+        run(ops, tab, path, name, results)
+
+    report = {'timestamp': datetime.now().isoformat(),
+              'backend': ('mysql' if args.mysql else
+                          'sqlite' if args.sqlite else 'memory'),
+              'params': vars(args),
+              'results': results}
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    logging.info('*** results in "%s" ***', args.output)
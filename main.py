@@ -1,81 +1,200 @@
 import argparse
 import logging
-from io import BytesIO
-from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import groupby, islice
 from zipfile import ZipFile
 
-from ckanapi import RemoteCKAN
+from mysql.connector.pooling import CNX_POOL_MAXSIZE
 
+from anac import path as log_path
 from anac import statements as stmts
+from anac.cache import Cache
+from anac.catalog import Catalog
 from anac.load import DataBase, Operations
+from anac.metrics import metrics
+from anac.mirror import Mirror
+from anac.pipeline import prefetch
+from anac.profiling import profiles
+from anac.refresh import Watermarks
+from anac.sintesi import Sintesi
+from anac.sqlite import SQLiteDataBase
+from anac.stream import open_member
+
+
+def get_packages(tables, cache, catalog, marks, refresh=False,
+                 snapshot=False):
+    '''
+    Ritorna l'elenco dei packages associati alle tabelle richieste con le
+    relative risorse, letto dal portale oppure dal catalogo locale con
+    "snapshot". In modalità offline l'elenco viene ricostruito dalla cache.
+    Con "refresh" vengono esclusi i packages non modificati.
+    '''
+    if cache.offline:
+        return list(cache.packages(tables))
+
+    if snapshot:
+        packages = catalog.read(tables)
+    elif refresh:
+        packages = catalog.search(tables)
+    else:
+        packages = catalog.fetch(tables)
+
+    selected = []
+    for table, pack in packages:
+        if marks.package_changed(pack) or not refresh:
+            selected.append((table, pack['name'], pack['resources']))
+
+    return selected
+
+
+def get_resources(ops, packages, marks, refresh=False):
+    '''
+    Ritorna le risorse da caricare, escludendo quelle che non sono file
+    json compressi e quelle inserite in precedenza. Con "refresh" vengono
+    considerate solo le risorse nuove o modificate.
+    '''
+    for table, pack, resources in packages:
+        pending = 0
+
+        for res in resources:
+            is_json = res['format'] == 'JSON'
+            is_zip = res['mimetype'] == 'application/zip'
+
+            if not (is_json and is_zip):
+                continue
 
-cnx = DataBase(**stmts.DB_CREDENTIALS)
+            name = f'{res["name"]}.json'
+            known = res['id'] in marks.resources
 
-anac_ops = Operations(database=cnx)
+            if refresh and known:
+                if not marks.resource_changed(res):
+                    continue
+
+            elif name in ops.loaded:
+                logging.warning('"%s" already loaded', name)
+
+                if not known:
+                    marks.set_resource(table, pack, res)
+
+                continue
+
+            pending += 1
 
+            yield table, pack, res
 
-def index(pckgs):
+        if not pending:
+            marks.set_package(pack)
+
+
+@contextmanager
+def open_resource(table, res, path=None):
     '''
-    Crea un indice dei packages col nome della tabella associata.
+    Apre il file json di una risorsa: dal file zip nella cache oppure,
+    senza "path", decomprimendolo mentre viene scaricato.
     '''
-    for pack in sorted(pckgs):
-        for tab in sorted(stmts.CREATE_TABLES, reverse=True, key=len):
-            if pack.startswith((tab.replace('_', '-'), tab)):
-                yield tab, pack
-                break
+    name = f'{res["name"]}.json'
+
+    if path is None:
+        with open_member(res['url'], name,
+                         stats=metrics.record(table, name)) as file:
+            yield file
 
+    else:
+        with ZipFile(path) as zfile, zfile.open(name) as file:
+            yield file
 
-def download_and_load(ops, tables):
+
+def download_and_load(ops, packages, cache, marks, refresh=False,
+                      depth=stmts.PREFETCH_DEPTH,
+                      max_bytes=stmts.PREFETCH_BYTES, stream=False):
     '''
-    Esegue il download dei files in memoria, la creazione delle
+    Esegue il download dei files nella cache locale, la creazione delle
     tabelle e l'inserimento dei file nelle tabelle, a meno che
-    non siano stati inseriti in precedenza.
+    non siano stati inseriti in precedenza. I download delle risorse
+    successive procedono in parallelo all'inserimento di quella corrente.
+    Con "stream" i file vengono decompressi ed inseriti durante il
+    download, senza essere salvati nella cache.
     '''
-    with RemoteCKAN(stmts.URL_ANAC) as ckan:
-        packages = ckan.action.package_list()
+    def fetch(item):
+        table, pack, res = item
 
-        for table, pack in index(packages):
-            tot_rows = 0
-            loaded = None
+        with profiles.profile(f'{table}_download'):
+            return cache.get(res, table, pack)
 
-            if table not in tables:
-                continue
+    def size(item):
+        return item[2].get('size') or 0
 
-            results = ckan.action.package_show(id=pack)
+    resources = get_resources(ops, packages, marks, refresh)
 
-            for res in results['resources']:
-                is_json = res['format'] == 'JSON'
-                is_zip = res['mimetype'] == 'application/zip'
+    if stream:
+        downloads = ((item, None) for item in resources)
+    else:
+        downloads = prefetch(fetch, resources, depth, max_bytes, size)
 
-                if not (is_json and is_zip):
-                    continue
+    for (table, pack), group in groupby(downloads, key=lambda d: d[0][:2]):
+        tot_rows = 0
+        skipped = False
 
-                url, name = res['url'], f'{res["name"]}.json'
+        for (_, _, res), path in group:
+            try:
+                with (profiles.profile(table),
+                        open_resource(table, res, path) as file):
 
-                if (loaded := name in ops.loaded):
-                    logging.warning('"%s" already loaded', name)
-                    continue
+                    ops.create(stmts.CREATE_TABLES, table, hash=True)
 
-                ops.create(stmts.CREATE_TABLES, table, hash=True)
+                    offset, done = ops.get_progress(table, file.name)
 
-                try:
-                    with urlopen(url) as res:
-                        logging.info('DOWNLOAD : "%s" ...', name)
+                    reader = ops.get_rows(
+                        ops.skip_rows(file, offset), ops.columns,
+                        stats=metrics.record(table, file.name),
+                        pool=ops.pool, ahead=2 * ops.parsers)
+                    rows = ops.load(reader, table, file.name, offset, done)
 
-                        with (ZipFile(BytesIO(res.read())) as zfile,
-                                zfile.open(name) as file):
+                tot_rows += rows
 
-                            reader = ops.get_rows(file, ops.columns)
-                            rows = ops.load(reader, table, file.name)
+            except StopIteration:
+                skipped = True
+                continue
 
-                    tot_rows += rows
+            marks.set_resource(table, pack, res)
 
-                except StopIteration:
-                    continue
+        # un package con risorse non caricate va riletto al prossimo avvio
+        if not skipped:
+            marks.set_package(pack)
+
+        logging.info(
+            '*** %s row into "%s" ***', tot_rows, table)
+
+    tables = {table for table, _, _ in packages}
+
+    ops.build_deferred_keys(tables)
+    ops.swap_tables(tables)
+
+
+def load_tables(ops, packages, cache, marks, refresh=False, jobs=1,
+                depth=stmts.PREFETCH_DEPTH, max_bytes=stmts.PREFETCH_BYTES,
+                stream=False):
+    '''
+    Carica le tabelle indicate. Con "jobs" maggiore di uno le tabelle
+    vengono caricate in parallelo, ognuna con il proprio stato e con
+    le proprie connessioni prese dal pool.
+    '''
+    if jobs <= 1:
+        download_and_load(
+            ops, packages, cache, marks, refresh, depth, max_bytes, stream)
+        return
+
+    by_table = groupby(sorted(packages, key=lambda p: p[0]), key=lambda p: p[0])
 
-            if not loaded:
-                logging.info(
-                    '*** %s row into "%s" ***', tot_rows, table)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            pool.submit(download_and_load, ops.fork(), list(group), cache,
+                        marks, refresh, depth, max_bytes, stream)
+            for _, group in by_table]
+
+        for future in futures:
+            future.result()
 
 
 def add_user_tables(ops, tables, user_tabs=stmts.USER_TABS):
@@ -87,59 +206,311 @@ def add_user_tables(ops, tables, user_tabs=stmts.USER_TABS):
         if tab not in tables:
             continue
 
+        rows = 0
+
         with open(path) as file:
             if (file.name in ops.loaded):
                 logging.warning('"%s" already loaded', file.name)
-                continue
 
-            ops.create(stmts.CREATE_USER_TABLES, tab, hash=True)
+            else:
+                with profiles.profile(tab):
+                    ops.create(stmts.CREATE_USER_TABLES, tab, hash=True)
 
-            reader = ops.get_rows(file, ops.columns)
-            rows = ops.load(reader, tab, file.name)
+                    offset, done = ops.get_progress(tab, file.name)
+
+                    reader = ops.get_rows(
+                        ops.skip_rows(file, offset), ops.columns,
+                        stats=metrics.record(tab, file.name),
+                        pool=ops.pool, ahead=2 * ops.parsers)
+                    rows = ops.load(reader, tab, file.name, offset, done)
+
+        ops.build_deferred_keys({tab})
+        ops.swap_tables({tab})
 
         logging.info(
             '*** %s row into "%s" ***', rows, tab)
 
 
+def rebuild_tables(ops, mirror, tables):
+    '''
+    Ricostruisce le tabelle indicate dalla copia Parquet delle risorse,
+    senza scaricare e decodificare di nuovo i file json.
+    '''
+    for tab in mirror.get_tables():
+        if tab not in tables:
+            continue
+
+        if tab in stmts.CREATE_TABLES:
+            statements = stmts.CREATE_TABLES
+        else:
+            statements = stmts.CREATE_USER_TABLES
+
+        tot_rows = 0
+
+        for path, name in mirror.get_files(tab):
+            if name in ops.loaded:
+                logging.warning('"%s" already loaded', name)
+                continue
+
+            with profiles.profile(tab):
+                ops.create(statements, tab, hash=True)
+
+                offset, done = ops.get_progress(tab, name)
+
+                reader = islice(mirror.read(path, ops.columns), offset, None)
+                tot_rows += ops.load(reader, tab, name, offset, done)
+
+        ops.build_deferred_keys({tab})
+        ops.swap_tables({tab})
+
+        logging.info(
+            '*** %s row into "%s" ***', tot_rows, tab)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(prog='main')
 
     subparsers = parser.add_subparsers(
         title='subcommands', dest='command', required=True)
 
-    dw_ld = subparsers.add_parser(
-        'load', description='executes all steps for db\
-            creation: download files, create tables, insert data')
+    options = argparse.ArgumentParser(add_help=False)
 
-    dw_ld.add_argument(
+    options.add_argument(
         '-t', '--tables', nargs='*', type=str,
         metavar='NAME', default=[],
         help='provide tables name to insert into db')
 
-    dw_ld.add_argument(
+    options.add_argument(
         '-s', '--skip', nargs='*', type=str,
         metavar='NAME', default=['smartcig'],
         help='provide tables name to skip, default value: "smartcig".\
             If called without values no tables are skipped')
 
+    options.add_argument(
+        '-c', '--cache', type=str, metavar='PATH',
+        default=stmts.CACHE_PATH,
+        help=f'directory for downloaded files, default value: "{stmts.CACHE_PATH}"')
+
+    options.add_argument(
+        '-o', '--offline', action='store_true',
+        help='load only files already in cache, without contacting the portal')
+
+    options.add_argument(
+        '--stream', action='store_true',
+        help='decompress and insert the files while downloading them,\
+            without saving them in the cache')
+
+    options.add_argument(
+        '--prefetch', type=int, metavar='N',
+        default=stmts.PREFETCH_DEPTH,
+        help=f'number of files downloaded ahead of the one being inserted,\
+            default value: {stmts.PREFETCH_DEPTH}')
+
+    options.add_argument(
+        '--prefetch-bytes', type=int, metavar='BYTES',
+        default=stmts.PREFETCH_BYTES,
+        help='maximum size of the files downloaded ahead')
+
+    options.add_argument(
+        '-j', '--jobs', type=int, metavar='N', default=1,
+        help='number of tables loaded concurrently, default value: 1')
+
+    options.add_argument(
+        '--snapshot', action='store_true',
+        help=f'plan the load from the local catalog "{stmts.CATALOG_PATH}"\
+            saved by a previous run, without querying the portal')
+
+    options.add_argument(
+        '--catalog-workers', type=int, metavar='N',
+        default=stmts.CATALOG_WORKERS,
+        help=f'number of concurrent requests for the catalog,\
+            default value: {stmts.CATALOG_WORKERS}')
+
+    options.add_argument(
+        '--sqlite', type=str, metavar='PATH',
+        help='load into a local SQLite database file instead of MySQL;\
+            --infile, --partition and --swap are not supported')
+
+    options.add_argument(
+        '--compress', action='store_true',
+        help='compress the traffic between client and MySQL server')
+
+    options.add_argument(
+        '--no-binlog', action='store_true',
+        help='do not write the loaded rows to the binary log, if the user\
+            is allowed to; they are not replicated')
+
+    options.add_argument(
+        '--infile', nargs='*', type=str, metavar='NAME', default=[],
+        help='provide tables name to insert with LOAD DATA LOCAL INFILE\
+            instead of INSERT statements')
+
+    options.add_argument(
+        '--dedup', nargs='*', type=str, metavar='NAME', default=[],
+        help='provide tables name whose rows already in db are skipped\
+            before sending them, comparing their hash client-side')
+
+    options.add_argument(
+        '--upsert', nargs='*', type=str, metavar='NAME', default=[],
+        help=f'provide tables name whose rows update the ones with the same\
+            natural key instead of adding a new version; supported tables:\
+            {", ".join(stmts.NATURAL_KEYS)}')
+
+    options.add_argument(
+        '--fresh', action='store_true',
+        help='create new tables without secondary indexes and build them\
+            with a single ALTER TABLE after all files are loaded')
+
+    options.add_argument(
+        '--partition', action='store_true',
+        help=f'partition by year the new tables {", ".join(stmts.PARTITIONS)}')
+
+    options.add_argument(
+        '--mirror', nargs='?', type=str, metavar='PATH',
+        const=stmts.MIRROR_PATH, default=None,
+        help=f'also write every loaded file as Parquet, partitioned by table,\
+            year and month, default path: "{stmts.MIRROR_PATH}"')
+
+    options.add_argument(
+        '--parsers', type=int, metavar='N', default=1,
+        help='number of processes decoding the json files, default value: 1.\
+            With more than one process blocks of rows are decoded in parallel')
+
+    options.add_argument(
+        '--prometheus', action='store_true',
+        help='also write the run metrics as a Prometheus textfile')
+
+    options.add_argument(
+        '--profile', nargs='?', choices=['cprofile', 'sample'],
+        const='cprofile', default=None,
+        help='write per-table profiles next to the log: "cprofile" (default)\
+            traces every call, "sample" samples the stack with low overhead')
+
+    dw_ld = subparsers.add_parser(
+        'load', parents=[options], description='executes all steps for db\
+            creation: download files, create tables, insert data')
+
+    dw_ld.add_argument(
+        '--reload', nargs='+', type=int, metavar='YEAR', default=[],
+        help='empty the partitions of these years and load again the files\
+            whose name contains them; years without such files are skipped.\
+            Rows of a year stored in files named after another year are\
+            lost, so it does not suit "aggiudicazioni"')
+
+    dw_ld.add_argument(
+        '--swap', nargs='*', type=str, metavar='NAME', default=[],
+        help='provide tables name to load from scratch into a shadow table,\
+            swapped with the current one by an atomic RENAME TABLE at the end')
+
+    refresh = subparsers.add_parser(
+        'refresh', parents=[options], description='downloads and inserts\
+            only the files added or modified on the portal since the last run')
+
+    rebuild = subparsers.add_parser(
+        'rebuild', parents=[options], description='rebuilds the tables from\
+            the Parquet copy written with --mirror, read from its path')
+
     sintesi = subparsers.add_parser(
         'sintesi', description='executes all steps to setup\
             the table "sintesi" and create the view "sintesi_cpv"')
 
+    sintesi.add_argument(
+        '--full', action='store_true',
+        help='rebuild the table "sintesi" from scratch instead of updating\
+            only the rows inserted since the last run')
+
     args = parser.parse_args()
 
     def main(args):
-        if args.command == 'load':
-            schema = stmts.CREATE_TABLES | stmts.CREATE_USER_TABLES
+        jobs = getattr(args, 'jobs', 1)
+
+        mirror = None
+        if args.command in ('load', 'refresh') and args.mirror:
+            mirror = Mirror(args.mirror)
+
+        if getattr(args, 'sqlite', None):
+            cnx = SQLiteDataBase(args.sqlite)
+        else:
+            # ogni tabella usa fino a due connessioni, più quella principale
+            max_jobs = (CNX_POOL_MAXSIZE - 1) // 2
+
+            if jobs > max_jobs:
+                parser.error(f'--jobs supports at most {max_jobs} tables'
+                             ' with MySQL')
+
+            settings = dict(stmts.SESSION_SETTINGS)
+            if getattr(args, 'no_binlog', False):
+                settings['sql_log_bin'] = 0
+
+            cnx = DataBase(**stmts.DB_CREDENTIALS,
+                           pool_size=max(stmts.POOL_SIZE, 2 * jobs + 1),
+                           compress=getattr(args, 'compress', False),
+                           settings=settings,
+                           local_infile=bool(getattr(args, 'infile', ())))
+
+        with Operations(database=cnx,
+                        infile=getattr(args, 'infile', ()),
+                        dedup=getattr(args, 'dedup', ()),
+                        fresh=getattr(args, 'fresh', False),
+                        parsers=getattr(args, 'parsers', 1),
+                        partition=getattr(args, 'partition', False),
+                        swap=getattr(args, 'swap', ()),
+                        mirror=mirror,
+                        upsert=getattr(args, 'upsert', ())) as anac_ops:
+
+            if args.command in ('load', 'refresh', 'rebuild'):
+                if args.command == 'refresh' and args.offline:
+                    parser.error('refresh requires access to the portal')
+
+                if args.offline and args.stream:
+                    parser.error('--stream requires access to the portal')
+
+                if args.partition and args.upsert:
+                    parser.error('--upsert does not support partitioned tables')
+
+                profiles.mode = args.profile
+
+                schema = stmts.CREATE_TABLES | stmts.CREATE_USER_TABLES
+
+                for tab in args.tables:
+                    if tab not in schema:
+                        raise ValueError(f'table "{tab}" not in database schema')
+
+                to_load = set(args.tables or schema) - set(args.skip)
+
+                if args.command == 'rebuild':
+                    mirror = Mirror(args.mirror or stmts.MIRROR_PATH)
+
+                    rebuild_tables(anac_ops, mirror, to_load)
+
+                else:
+                    refresh = args.command == 'refresh'
+
+                    cache = Cache(args.cache, offline=args.offline)
+                    catalog = Catalog(stmts.CATALOG_PATH, args.catalog_workers)
+                    marks = Watermarks(cnx)
+
+                    packages = get_packages(
+                        to_load, cache, catalog, marks, refresh, args.snapshot)
+
+                    if not refresh and args.reload:
+                        for tab in sorted(to_load & set(stmts.PARTITIONS)):
+                            anac_ops.reload(tab, args.reload)
+
+                    load_tables(anac_ops, packages, cache, marks, refresh, jobs,
+                                args.prefetch, args.prefetch_bytes, args.stream)
+
+                add_user_tables(anac_ops, to_load)
 
-            for tab in args.tables:
-                if tab not in schema:
-                    raise ValueError(f'table "{tab}" not in database schema')
+                report = log_path.replace('.log', '.json')
+                prometheus = (args.prometheus and
+                              log_path.replace('.log', '.prom'))
 
-            to_load = set(args.tables or schema) - set(args.skip)
+                metrics.write(report, prometheus)
+                profiles.dump(log_path.replace('.log', ''))
 
-            download_and_load(anac_ops, to_load)
-            add_user_tables(anac_ops, to_load)
+            elif args.command == 'sintesi':
+                Sintesi(cnx).update(full=args.full)
 
         logging.info('*** COMPLETED ***')
 
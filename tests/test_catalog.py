@@ -0,0 +1,136 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from anac.catalog import Catalog, index
+
+PACKAGES = ['cig-2023', 'cig-2024', 'smartcig-2024', 'cup',
+            'smartcig-tipo-fattispecie-contrattuale', 'portale-trasparenza']
+
+
+def package(name):
+    return {'name': name,
+            'metadata_modified': '2024-01-01T00:00:00',
+            'resources': [{'id': f'{name}-json', 'name': name,
+                           'format': 'JSON', 'mimetype': 'application/zip',
+                           'url': f'http://localhost/{name}.zip'}]}
+
+
+class FakeCKAN(BaseHTTPRequestHandler):
+    '''
+    Risponde alle azioni package_list, package_show e package_search
+    dell'API di CKAN con i packages di PACKAGES.
+    '''
+    calls = []
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        action = self.path.rstrip('/').rsplit('/', 1)[-1]
+        length = int(self.headers.get('Content-Length') or 0)
+        data = json.loads(self.rfile.read(length) or b'{}')
+
+        with self.lock:
+            self.calls.append((action, threading.get_ident()))
+
+        if action == 'package_list':
+            result = PACKAGES
+        elif action == 'package_show':
+            result = package(data['id'])
+        elif action == 'package_search':
+            start, rows = data.get('start', 0), data.get('rows', 10)
+            result = {'count': len(PACKAGES),
+                      'results': [package(name) for name in
+                                  PACKAGES[start:start + rows]]}
+        else:
+            self.send_error(404)
+            return
+
+        body = json.dumps({'success': True, 'result': result}).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestCatalog(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeCKAN)
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}/'
+
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeCKAN.calls.clear()
+
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'catalog.json')
+        self.catalog = Catalog(self.path, workers=4, url=self.url)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_index(self):
+        self.assertEqual(list(index(PACKAGES)), [
+            ('cig', 'cig-2023'), ('cig', 'cig-2024'), ('cup', 'cup'),
+            ('smartcig', 'smartcig-2024'),
+            ('smartcig_tipo_fattispecie_contrattuale',
+             'smartcig-tipo-fattispecie-contrattuale')])
+
+    def test_fetch(self):
+        packages = self.catalog.fetch({'cig', 'cup'})
+
+        self.assertEqual([(table, pack['name']) for table, pack in packages],
+                         [('cig', 'cig-2023'), ('cig', 'cig-2024'),
+                          ('cup', 'cup')])
+
+        shows = [call for call in FakeCKAN.calls if call[0] == 'package_show']
+        self.assertEqual(len(shows), 3)
+
+    def test_fetch_saves_snapshot(self):
+        packages = self.catalog.fetch({'cig'})
+
+        self.assertEqual(self.catalog.read({'cig'}), packages)
+        self.assertEqual(self.catalog.read({'cup'}), [])
+
+    def test_fetch_keeps_other_tables(self):
+        self.catalog.fetch({'cig'})
+        self.catalog.fetch({'cup'})
+
+        tables = [table for table, _ in self.catalog.read()]
+        self.assertEqual(sorted(tables), ['cig', 'cig', 'cup'])
+
+    def test_search(self):
+        packages = self.catalog.search({'smartcig'}, rows=4)
+
+        self.assertEqual([pack['name'] for _, pack in packages],
+                         ['smartcig-2024'])
+
+        searches = [call for call in FakeCKAN.calls
+                    if call[0] == 'package_search']
+        self.assertEqual(len(searches), 2)
+
+        # il catalogo salvato contiene i packages di tutte le tabelle
+        self.assertEqual(len(self.catalog.read()), 5)
+
+    def test_read_missing_snapshot(self):
+        with self.assertRaises(FileNotFoundError):
+            self.catalog.read()
+
+
+if __name__ == '__main__':
+    unittest.main()
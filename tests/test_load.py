@@ -0,0 +1,63 @@
+import random
+import unittest
+
+from anac.load import RowMapper
+
+REFCOLS = ('cig', 'cig_accordo_quadro', 'numero_gara', 'oggetto_gara',
+           'importo_lotto', 'importo', 'cod_cpv', 'descrizione_cpv',
+           'data_pubblicazione', 'provincia', 'sigla_provincia')
+
+# chiavi dei file json: colonne dello schema con maiuscole, trattini e
+# suffissi diversi, oltre a chiavi non previste
+KEYS = ('cig', 'CIG', 'cig-accordo-quadro', 'cig_accordo_quadro_x',
+        'numero_gara', 'Numero-Gara', 'oggetto_gara', 'oggetto_gara_2',
+        'importo', 'importo_lotto', 'IMPORTO_LOTTO_EUR', 'cod_cpv',
+        'cod-cpv-2', 'descrizione_cpv', 'data_pubblicazione', 'provincia',
+        'provincia_codice', 'sigla_provincia', 'altro', 'nuova-colonna')
+
+VALUES = ('', None, 0, 0.0, False, [], {}, 'a', 'Z01234', 1, 2.5, True)
+
+
+def fix(row, refcols):
+    '''
+    Associazione usata prima di RowMapper, applicata ad ogni riga.
+    '''
+    select = {}
+
+    for k in sorted(row, key=len):
+        _k = k.replace('-', '_')
+
+        for col in sorted(refcols, key=len, reverse=True):
+            starts = _k.lower().startswith(col.lower())
+
+            if starts and col not in select:
+                select[col] = row[k] or None
+                break
+
+    return tuple(select.get(col) for col in refcols)
+
+
+class TestRowMapper(unittest.TestCase):
+
+    def test_same_as_fix(self):
+        rand = random.Random(0)
+        mapper = RowMapper(REFCOLS)
+
+        for _ in range(2000):
+            keys = rand.sample(KEYS, rand.randint(0, len(KEYS)))
+            row = {key: rand.choice(VALUES) for key in keys}
+
+            self.assertEqual(mapper(row), fix(row, REFCOLS), row)
+
+    def test_plans_by_keys(self):
+        mapper = RowMapper(('cig', 'importo'))
+
+        self.assertEqual(mapper({'CIG': 'a', 'importo_lotto': 1}), ('a', 1))
+        self.assertEqual(mapper({'CIG': 'b', 'importo_lotto': ''}),
+                         ('b', None))
+        self.assertEqual(mapper({'importo_lotto': 2, 'CIG': 'c'}), ('c', 2))
+        self.assertEqual(len(mapper.plans), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
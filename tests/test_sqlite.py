@@ -0,0 +1,163 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from anac import statements as stmts
+from anac.load import Operations, skip_rows
+from anac.mirror import Mirror, pq
+from anac.sqlite import SQLiteDataBase, translate
+
+ROWS = [{'cig': f'Z{n:09d}', 'cup': f'C{n:014d}'} for n in range(50)]
+
+
+def lines(rows):
+    return io.StringIO(''.join(json.dumps(row) + '\n' for row in rows))
+
+
+class TestSQLite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+        # senza attese sul lock del file un conflitto fallirebbe subito
+        self.database = SQLiteDataBase(
+            os.path.join(self.folder.name, 'anac.db'), timeout=0.01)
+        self.ops = Operations(self.database)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def count(self, table):
+        stmt = f'SELECT COUNT(*) AS n FROM {table}'
+
+        return self.database.execute(stmt).fetchone()['n']
+
+    def load(self, table, rows, name='cup_1.json', ops=None):
+        ops = ops or self.ops
+        ops.create(stmts.CREATE_TABLES, table, hash=True)
+
+        offset, done = ops.get_progress(table, name)
+        reader = ops.get_rows(skip_rows(lines(rows), offset), ops.columns)
+
+        return ops.load(reader, table, name, offset, done)
+
+    def test_translate_comments(self):
+        stmt = translate('CREATE TABLE t (\n    a INT,\n'
+                         '    #b INT,\n    -- c INT,\n    d INT)')
+
+        self.assertEqual(stmt, 'CREATE TABLE t (\n    a INT,\n    d INT)')
+
+    def test_create_all_tables(self):
+        for statements in (stmts.CREATE_TABLES, stmts.CREATE_USER_TABLES):
+            for table in statements:
+                with self.subTest(table=table):
+                    self.ops.fork().create(statements, table, hash=True)
+
+                    columns = self.ops.get_columns(table)
+                    self.assertTrue(columns)
+                    self.assertNotIn('data_inserimento', columns)
+
+    def test_interrupted_fresh_keys(self):
+        Operations(self.database, fresh=True).create(
+            stmts.CREATE_TABLES, 'cup', hash=True)
+
+        self.ops.create(stmts.CREATE_TABLES, 'cup', hash=True)
+        self.ops.build_deferred_keys({'cup'})
+
+        indexes = {row['INDEX_NAME'] for row in self.database.execute(
+            self.database.statements.GET_INDEXES, ('cup',))}
+        self.assertIn('idx_cup_cig', indexes)
+
+    def test_load(self):
+        self.assertEqual(self.load('cup', ROWS), len(ROWS))
+        self.assertEqual(self.count('cup'), len(ROWS))
+        self.assertIn('cup_1.json', self.ops.loaded)
+
+        # le righe già presenti vengono scartate dalla chiave sull'hash
+        self.assertEqual(self.load('cup', ROWS, 'cup_2.json'), 0)
+        self.assertEqual(self.count('cup'), len(ROWS))
+
+    def test_load_resumes(self):
+        self.ops.create(stmts.CREATE_TABLES, 'cup', hash=True)
+        self.database.execute(self.database.statements.SET_PROGRESS,
+                              ('cup', 'cup_1.json', 20, 20))
+
+        self.assertEqual(self.load('cup', ROWS), len(ROWS) - 20)
+        self.assertEqual(self.ops.get_progress('cup', 'cup_1.json'), (0, 0))
+
+    def test_upsert(self):
+        self.ops = Operations(self.database, upsert={'cig'})
+
+        rows = [{'cig': f'Z{n:09d}', 'oggetto_gara': 'a'} for n in range(10)]
+        self.assertEqual(self.load('cig', rows, 'cig_1.json'), 10)
+
+        # 3 righe modificate, 2 nuove e 5 invariate
+        rows = rows[:5] + [{'cig': row['cig'], 'oggetto_gara': 'b'}
+                           for row in rows[5:8]]
+        rows += [{'cig': f'Y{n:09d}', 'oggetto_gara': 'a'} for n in range(2)]
+
+        data = list(self.ops.get_rows(lines(rows), self.ops.columns))
+
+        self.assertEqual(self.ops.upsert_rows('cig', data), (2, 3))
+        self.assertEqual(self.count('cig'), 12)
+
+        # un nuovo file con le stesse righe non inserisce né aggiorna nulla
+        self.assertEqual(self.load('cig', rows, 'cig_2.json'), 0)
+        self.assertEqual(self.count('cig'), 12)
+
+    @unittest.skipIf(pq is None, 'requires "pyarrow"')
+    def test_load_resumes_mirrored(self):
+        mirror = Mirror(os.path.join(self.folder.name, 'mirror'))
+        self.ops = Operations(self.database, mirror=mirror)
+
+        self.ops.create(stmts.CREATE_TABLES, 'cup', hash=True)
+        self.database.execute(self.database.statements.SET_PROGRESS,
+                              ('cup', 'cup_1.json', 20, 20))
+
+        offset, done = self.ops.get_progress('cup', 'cup_1.json')
+        reader = self.ops.get_rows(
+            self.ops.skip_rows(lines(ROWS), offset), self.ops.columns)
+
+        self.assertEqual(self.ops.load(reader, 'cup', 'cup_1.json',
+                                       offset, done), len(ROWS) - 20)
+        self.assertEqual(self.count('cup'), len(ROWS) - 20)
+
+        # la copia Parquet contiene anche le righe caricate in precedenza
+        path = mirror.get_path('cup', 'cup_1.json')
+        self.assertEqual(pq.read_table(path).num_rows, len(ROWS))
+
+    def test_concurrent_sessions(self):
+        rows = [{'cig': f'Z{n:09d}', 'cup': str(n)} for n in range(20_000)]
+        loaded, failed = {}, []
+
+        def load(table):
+            try:
+                loaded[table] = self.load(
+                    table, rows, f'{table}.json', self.ops.fork())
+            except Exception as err:
+                failed.append(err)
+
+        def write():
+            for n in range(50):
+                self.database.execute(self.database.statements.SET_PROGRESS,
+                                      ('other', str(n), n, n))
+
+        threads = [threading.Thread(target=load, args=(table,))
+                   for table in ('cup', 'fine_contratto')]
+        threads.append(threading.Thread(target=write))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(failed, [])
+        self.assertEqual(loaded, {'cup': len(rows),
+                                  'fine_contratto': len(rows)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import io
+import unittest
+import zipfile
+from zipfile import BadZipFile
+
+from anac.stream import ZipMember
+
+DATA = b''.join(b'{"cig": "Z%09d", "importo": %d}\n' % (n, n) for n in range(5000))
+
+
+class Unseekable:
+    '''
+    File in sola scrittura: zipfile vi scrive i file con data descriptor.
+    '''
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+
+class Chunked:
+    '''
+    Sorgente che restituisce al massimo "size" byte per lettura, come il
+    corpo di una risposta HTTP.
+    '''
+    def __init__(self, data, size=1000):
+        self.data = data
+        self.size = size
+        self.offset = 0
+        self.closed = False
+
+    def read(self, size):
+        data = self.data[self.offset:self.offset + min(size, self.size)]
+        self.offset += len(data)
+
+        return data
+
+    def close(self):
+        self.closed = True
+
+
+def archive(members, method=zipfile.ZIP_DEFLATED, descriptor=False,
+            zip64=False):
+    file = Unseekable() if descriptor else io.BytesIO()
+
+    with zipfile.ZipFile(file, 'w', compression=method) as zfile:
+        for name, data in members:
+            with zfile.open(name, 'w', force_zip64=zip64) as member:
+                member.write(data)
+
+    return file.getvalue()
+
+
+def read(data, name='cig.json', size=1000):
+    source = Chunked(data, size)
+
+    with io.BufferedReader(ZipMember(source, name), 4096) as file:
+        content = file.read()
+
+    return content, source
+
+
+class TestZipMember(unittest.TestCase):
+
+    def assertMember(self, data, expected=DATA, name='cig.json'):
+        for size in (1, 7, 1000, len(data)):
+            with self.subTest(size=size):
+                content, source = read(data, name, size)
+
+                self.assertEqual(content, expected)
+                self.assertTrue(source.closed)
+
+    def test_deflated(self):
+        self.assertMember(archive([('cig.json', DATA)]))
+
+    def test_stored(self):
+        self.assertMember(archive([('cig.json', DATA)], zipfile.ZIP_STORED))
+
+    def test_deflated_descriptor(self):
+        data = archive([('cig.json', DATA)], descriptor=True)
+
+        self.assertTrue(data[6] & 0x08)
+        self.assertMember(data)
+
+    def test_deflated_descriptor_zip64(self):
+        self.assertMember(
+            archive([('cig.json', DATA)], descriptor=True, zip64=True))
+
+    def test_stored_descriptor(self):
+        data = archive([('cig.json', DATA)], zipfile.ZIP_STORED,
+                       descriptor=True)
+
+        with self.assertRaisesRegex(BadZipFile, 'unknown size'):
+            read(data)
+
+    def test_skip_members(self):
+        members = [('a.txt', b'a' * 10_000), ('cig.json', DATA),
+                   ('b.txt', b'b')]
+
+        for method in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            with self.subTest(method=method):
+                self.assertMember(archive(members, method))
+
+        self.assertMember(archive(members, descriptor=True))
+
+    def test_missing_member(self):
+        with self.assertRaises(KeyError):
+            read(archive([('a.txt', b'a')]))
+
+    def test_truncated(self):
+        for method in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            data = archive([('cig.json', DATA)], method)
+
+            for end in (10, 100, len(data) // 2):
+                with self.subTest(method=method, end=end):
+                    with self.assertRaisesRegex(BadZipFile, 'truncated'):
+                        read(data[:end])
+
+    def test_truncated_descriptor(self):
+        data = archive([('cig.json', DATA)], descriptor=True)
+        end = data.index(b'PK\x07\x08') + 8
+
+        with self.assertRaisesRegex(BadZipFile, 'truncated'):
+            read(data[:end])
+
+    def test_bad_crc(self):
+        data = bytearray(archive([('cig.json', DATA)], zipfile.ZIP_STORED))
+        data[data.index(b'Z000000010')] ^= 1
+
+        with self.assertRaisesRegex(BadZipFile, 'CRC'):
+            read(bytes(data))
+
+    def test_bad_crc_descriptor(self):
+        data = bytearray(archive([('cig.json', DATA)], descriptor=True))
+        crc = data.index(b'PK\x07\x08') + 4
+        data[crc] ^= 1
+
+        with self.assertRaisesRegex(BadZipFile, 'CRC'):
+            read(bytes(data))
+
+
+if __name__ == '__main__':
+    unittest.main()